@@ -0,0 +1,319 @@
+'''Benchmarks for the record parsers, BTF parsing, ring buffers and maps.
+
+All benchmarks run unprivileged - ring buffers are anonymous memfd rings
+with the kernel layout, maps are userspace.UserspaceMap (BPFMap with the
+syscalls served from a dict) and the BTF is a synthetic blob generated on
+the fly (or a BTF file given with --btf).
+
+python3 -m pybpfmap.benchmark [--json results.json] [--compare old.json] [names]
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from pybpfmap.bpfrecord import BPFRecord, RingBufferInfo
+from pybpfmap.btfparse import BTFBlob, BTFKIND_INT, BTFKIND_ARRAY, BTFKIND_STRUCT
+from pybpfmap.btfparse import BTFKIND_TYPEDEF, BTFKIND_CONST, BTFHEADER, BTFTYPE
+from pybpfmap.btfparse import BTFINT, BTFARRAY, BTFSTRUCT, BTF_INT_SIGNED
+from pybpfmap.fields import CString, PackedArray
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_USER_RINGBUF
+from pybpfmap.userspace import UserspaceMap
+
+BTF_MAGIC = 0xeb9f
+
+RECORDS = 20000
+ENTRIES = 20000
+RING_SIZE = 1 << 20
+
+SHAPES = {
+    "flat": [("f{}".format(idx), "Q") for idx in range(0, 8)],
+    "nested": [("a", "I"), ("b", [("c", "I"), ("d", [("e", "Q"), ("f", "H")])]), ("g", "I")],
+    "array": [("index", "I"), ("data", ["Q"] * 16)],
+    "fields": [("pid", "I"), ("comm", CString(16)), ("counters", PackedArray("Q", 16))]
+}
+
+KEY = [("uid", "Q"), ("gid", "Q")]
+VALUE = [("packets", "Q"), ("bytes", "Q"), ("flags", "I"), ("comm", CString(16))]
+
+def synthetic_btf(count=2000):
+    '''Generate BTF data with count structs. Each struct has typedef'd,
+    const, char array and u64 array members and most of them nest the
+    previous struct, so every code path of the parser is exercised.'''
+
+    strings = bytearray(b"\0")
+    types = bytearray()
+
+    def name(text):
+        offset = len(strings)
+        strings.extend(text.encode("ascii") + b"\0")
+        return offset
+
+    def header(name_off, kind, vlen, size_or_type):
+        types.extend(BTFTYPE.pack(name_off, (kind << 24) | vlen, size_or_type))
+
+    # 1 - 7: base types
+    header(name("unsigned int"), BTFKIND_INT, 0, 4)
+    types.extend(BTFINT.pack(32))
+    header(name("char"), BTFKIND_INT, 0, 1)
+    types.extend(BTFINT.pack((BTF_INT_SIGNED << 24) | 8))
+    header(name("long long unsigned int"), BTFKIND_INT, 0, 8)
+    types.extend(BTFINT.pack(64))
+    header(name("u32"), BTFKIND_TYPEDEF, 0, 1)
+    header(0, BTFKIND_ARRAY, 0, 0)
+    types.extend(BTFARRAY.pack(2, 1, 16))
+    header(0, BTFKIND_ARRAY, 0, 0)
+    types.extend(BTFARRAY.pack(3, 1, 4))
+    header(0, BTFKIND_CONST, 0, 4)
+
+    members = [("id", 4, 4), ("flags", 7, 4), ("comm", 5, 16), ("counters", 6, 32)]
+    previous = None
+    for idx in range(0, count):
+        layout = list(members)
+        if previous is not None and idx % 8 != 0:
+            layout.append(("inner", previous[0], previous[1]))
+        header(name("bench_struct_{}".format(idx)), BTFKIND_STRUCT, len(layout),
+               sum([size for (member, tid, size) in layout]))
+        offset = 0
+        for (member, tid, size) in layout:
+            types.extend(BTFSTRUCT.pack(name(member), tid, offset * 8))
+            offset += size
+        previous = (8 + idx, offset)
+
+    return BTFHEADER.pack(BTF_MAGIC, 1, 0, BTFHEADER.size, 0, len(types),
+                          len(types), len(strings)) + bytes(types) + bytes(strings)
+
+def measure(func, repeat, setup=None):
+    '''Run func repeat times, calling setup (untimed) before each run.
+    Returns best and mean time per run.'''
+    times = []
+    for count in range(0, repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return (min(times), sum(times) / len(times))
+
+# Each benchmark is (name, function, operations per call, setup or None)
+
+def record_benchmarks():
+    '''pack/unpack of each template shape'''
+    result = []
+    for (shape, template) in SHAPES.items():
+        parser = BPFRecord(template)
+        buff = parser.compiled.pack(*parser.compiled.unpack(bytes(parser.compiled.size)))
+        value = parser.unpack(buff)
+        batch = buff * RECORDS
+
+        def unpack(parser=parser, buff=buff):
+            for count in range(0, RECORDS):
+                parser.unpack(buff)
+
+        def pack(parser=parser, value=value):
+            for count in range(0, RECORDS):
+                parser.pack(value)
+
+        def unpack_batch(parser=parser, batch=batch):
+            parser.unpack_batch(batch)
+
+        records = BPFRecord(template, records=True)
+
+        def unpack_records(records=records, batch=batch):
+            records.unpack_batch(batch)
+
+        result.extend([
+            ("record.{}.unpack".format(shape), unpack, RECORDS, None),
+            ("record.{}.pack".format(shape), pack, RECORDS, None),
+            ("record.{}.unpack_batch".format(shape), unpack_batch, RECORDS, None),
+            ("record.{}.unpack_records".format(shape), unpack_records, RECORDS, None)
+        ])
+    return result
+
+def btf_benchmarks(btf_path=None):
+    '''BTF parsing and parser info generation'''
+    if btf_path is None:
+        data = synthetic_btf()
+    else:
+        with open(btf_path, "rb") as btf:
+            data = btf.read()
+
+    def parse():
+        BTFBlob(data).parse()
+
+    blob = BTFBlob(data)
+    blob.parse()
+    structs = [element for element in blob.elements if element.tid == BTFKIND_STRUCT]
+
+    def pinfo():
+        # templates are cached in the types, start from a fresh parse
+        fresh = BTFBlob(data)
+        fresh.parse()
+        for element in fresh.elements:
+            if element.tid == BTFKIND_STRUCT:
+                element.generate_pinfo()
+
+    return [
+        ("btf.parse", parse, len(blob.elements), None),
+        ("btf.parse_and_pinfo", pinfo, len(structs), None)
+    ]
+
+def ringbuf_benchmarks():
+    '''Submit and fetch on an anonymous ring'''
+    ring = RingBufferInfo(-1, RING_SIZE, 0, BPF_MAP_TYPE_USER_RINGBUF, anonymous=True)
+    parser = BPFRecord(SHAPES["flat"])
+    sample = bytes(parser.compiled.size)
+    # records are 64 bytes + 8 bytes of header
+    count = RING_SIZE // (parser.compiled.size + 8) - 1
+
+    def fill():
+        for idx in range(0, count):
+            ring.submit(sample)
+
+    def drain():
+        ring.fetch_next_records()
+
+    def fetch_parsed():
+        ring.fetch_next_parsed(parser)
+
+    def fetch_tuples():
+        ring.fetch_next_parsed(parser, tuple)
+
+    # submit needs an empty ring, the fetches need a full one
+    return ([
+        ("ringbuf.submit", fill, count, drain),
+        ("ringbuf.fetch", drain, count, fill),
+        ("ringbuf.fetch_parsed", fetch_parsed, count, fill),
+        ("ringbuf.fetch_tuples", fetch_tuples, count, fill)
+    ], ring)
+
+def map_benchmarks():
+    '''Element, batch and dump operations on a userspace map'''
+    bpf_map = UserspaceMap(BPF_MAP_TYPE_HASH, "bench", 16, 36, ENTRIES)
+    bpf_map.generate_parsers(KEY, VALUE)
+    key_parser = bpf_map.parsers[0]
+    value_parser = bpf_map.parsers[1]
+    keys = [key_parser.pack({"uid": idx, "gid": 1}) for idx in range(0, ENTRIES)]
+    parsed_keys = [{"uid": idx, "gid": 1} for idx in range(0, ENTRIES)]
+    value = value_parser.pack({"packets": 1, "bytes": 2, "flags": 3, "comm": "bench"})
+    parsed_value = value_parser.unpack(value)
+
+    def update():
+        for key in keys:
+            bpf_map.update_elem(key, value)
+
+    def update_parsed():
+        for key in parsed_keys:
+            bpf_map.update_elem(key, parsed_value)
+
+    def update_batch():
+        bpf_map.update_batch([(key, value) for key in keys])
+
+    def lookup():
+        for key in keys:
+            bpf_map.lookup_elem(key)
+
+    def lookup_parsed():
+        for key in parsed_keys:
+            bpf_map.lookup_elem(key, want_parsed=True)
+
+    def dump():
+        for chunk in bpf_map.dump():
+            pass
+
+    def dump_columns():
+        bpf_map.dump_columns()
+
+    def snapshot():
+        bpf_map.snapshot()
+
+    snap = bpf_map.snapshot()
+
+    def diff():
+        for change in bpf_map.diff(snap, update=False):
+            pass
+
+    update()
+    return [
+        ("map.update", update, ENTRIES, None),
+        ("map.update_parsed", update_parsed, ENTRIES, None),
+        ("map.update_batch", update_batch, ENTRIES, None),
+        ("map.lookup", lookup, ENTRIES, None),
+        ("map.lookup_parsed", lookup_parsed, ENTRIES, None),
+        ("map.dump", dump, ENTRIES, None),
+        ("map.dump_columns", dump_columns, ENTRIES, None),
+        ("map.snapshot", snapshot, ENTRIES, None),
+        ("map.diff", diff, ENTRIES, None)
+    ]
+
+def run(names=None, repeat=5, btf_path=None, output=sys.stdout):
+    '''Run the benchmarks whose names start with any of names (all if
+    names is empty). Returns a list of result dicts.'''
+
+    (ring_benchmarks, ring) = ringbuf_benchmarks()
+    benchmarks = record_benchmarks() + btf_benchmarks(btf_path) + ring_benchmarks + map_benchmarks()
+
+    results = []
+    for (name, func, ops, setup) in benchmarks:
+        if names and not any([name.startswith(prefix) for prefix in names]):
+            continue
+        (best, mean) = measure(func, repeat, setup)
+        results.append({
+            "name": name,
+            "ops": ops,
+            "best": best,
+            "mean": mean,
+            "ns_per_op": best * 1e9 / ops
+        })
+        if output is not None:
+            output.write("{:40} {:12.1f} ns/op {:14.0f} ops/s\n".format(name, best * 1e9 / ops, ops / best))
+    ring.cleanup()
+    return results
+
+def compare(results, baseline, output=sys.stdout):
+    '''Print the change against a baseline from an earlier --json run'''
+    old = {item["name"]:item for item in baseline["results"]}
+    for item in results:
+        if item["name"] in old:
+            change = item["ns_per_op"] / old[item["name"]]["ns_per_op"] - 1
+            output.write("{:40} {:+7.1%}\n".format(item["name"], change))
+
+def main():
+    '''Command line entry point'''
+    args = argparse.ArgumentParser(description="pybpfmap benchmarks")
+    args.add_argument("--json", help="write results as JSON to this file")
+    args.add_argument("--compare", help="compare against a JSON file from an earlier run")
+    args.add_argument("--repeat", type=int, default=5, help="runs per benchmark, the best is reported")
+    args.add_argument("--btf", help="BTF file to use instead of the synthetic one")
+    args.add_argument("names", nargs="*", help="only run benchmarks starting with these names")
+    args = args.parse_args()
+
+    results = run(args.names, args.repeat, args.btf)
+
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump({
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "time": time.time(),
+                "repeat": args.repeat,
+                "results": results
+            }, out, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as baseline:
+            compare(results, json.load(baseline))
+
+if __name__ == "__main__":
+    main()
@@ -16,15 +16,17 @@ cdef extern from "linux/bpf.h":
 
     struct bpf_map_info:
         unsigned int type
+        unsigned int id
         unsigned int key_size
         unsigned int value_size
         unsigned int max_entries
+        unsigned int map_flags
         char name[16]
-        unsigned int id
         unsigned int btf_vmlinux_value_type_id
         unsigned int btf_id
         unsigned int btf_key_type_id
         unsigned int btf_value_type_id
+        unsigned long int map_extra
 
     
 
@@ -42,6 +44,14 @@ cdef extern from "bpf/bpf.h":
         unsigned int btf_key_type_id
         unsigned int btf_value_type_id
         unsigned int btf_vmlinux_value_type_id
+        unsigned int inner_map_fd
+        unsigned int map_flags
+        unsigned long int map_extra
+
+    struct bpf_map_batch_opts:
+        size_t sz
+        unsigned long int elem_flags
+        unsigned long int flags
 
     enum bpf_map_type:
         pass
@@ -53,9 +63,21 @@ cdef extern from "bpf/bpf.h":
     bint bpf_map_delete_elem(int fd, const void *key)
     bint bpf_map_get_next_key(int fd, const void *key, void *next_key)
     bint bpf_map_freeze(int fd)
+
+    int bpf_map_lookup_batch(int fd, void *in_batch, void *out_batch, void *keys,
+                             void *values, unsigned int *count,
+                             const bpf_map_batch_opts *opts)
+
+    int bpf_map_update_batch(int fd, const void *keys, const void *values,
+                             unsigned int *count, const bpf_map_batch_opts *opts)
+
+    int bpf_map_delete_batch(int fd, const void *keys, unsigned int *count,
+                             const bpf_map_batch_opts *opts)
     
     int bpf_obj_get(const char *pathname)
 
+    int bpf_map_get_fd_by_id(unsigned int id)
+
     bint bpf_obj_get_info_by_fd(int bpf_fd, void *info, unsigned int *info_len)
 
     int bpf_map_create(bpf_map_type map_type, const char *map_name, \
@@ -69,13 +91,54 @@ cdef extern from "sys/mman.h":
     void *mmap(void *addr, unsigned long int length, int prot, int flags, int fd, unsigned long int offset)
     int munmap(void *addr, size_t length)
 
+    cdef int PROT_NONE
     cdef int PROT_READ
     cdef int PROT_WRITE
     cdef int MAP_SHARED
+    cdef int MAP_PRIVATE
+    cdef int MAP_ANONYMOUS
+    cdef int MAP_FIXED
     cdef void *MAP_FAILED
 
 cdef extern from "unistd.h":
     int getpagesize()
+    long syscall(long number, ...)
+
+cdef extern from "sys/syscall.h":
+    cdef long SYS_perf_event_open
+
+cdef extern from "sys/ioctl.h":
+    int ioctl(int fd, unsigned long request, ...)
+
+cdef extern from "linux/perf_event.h":
+
+    struct perf_event_attr:
+        unsigned int type
+        unsigned int size
+        unsigned long int config
+        unsigned long int sample_period
+        unsigned long int sample_type
+        unsigned int wakeup_events
+
+    struct perf_event_mmap_page:
+        unsigned long int data_head
+        unsigned long int data_tail
+        unsigned long int data_offset
+        unsigned long int data_size
+
+    struct perf_event_header:
+        unsigned int type
+        unsigned short misc
+        unsigned short size
+
+    cdef int PERF_TYPE_SOFTWARE
+    cdef int PERF_COUNT_SW_BPF_OUTPUT
+    cdef int PERF_SAMPLE_RAW
+    cdef int PERF_RECORD_SAMPLE
+    cdef int PERF_RECORD_LOST
+    cdef int PERF_FLAG_FD_CLOEXEC
+    cdef unsigned long PERF_EVENT_IOC_ENABLE
+    cdef unsigned long PERF_EVENT_IOC_DISABLE
 
 cdef extern from "barrier.h":
 
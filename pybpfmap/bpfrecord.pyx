@@ -13,25 +13,69 @@ from struct import Struct, calcsize
 from struct import error as SError
 import sys
 import os
+import threading
+import select
+import mmap as pymmap
 import cython
+from types import MappingProxyType
+from itertools import chain
 import pybpfmap.btfparse
-from pybpfmap.map_types import BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_USER_RINGBUF
+from pybpfmap.snapshot import BPFMapSnapshot, ADDED, REMOVED, CHANGED
+from pybpfmap.fields import Field, CString, PackedArray
+from pybpfmap.records import record_class, record_decoder
+from pybpfmap.columns import ColumnDecoder
+from pybpfmap.map_types import BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_USER_RINGBUF, BPF_MAP_TYPE_ARRAY
+from pybpfmap.map_types import BPF_MAP_TYPE_ARRAY_OF_MAPS, BPF_MAP_TYPE_HASH_OF_MAPS
+from pybpfmap.map_types import BPF_MAP_TYPE_PERF_EVENT_ARRAY
+from pybpfmap.map_types import BPF_MAP_TYPE_QUEUE, BPF_MAP_TYPE_STACK, BPF_MAP_TYPE_BLOOM_FILTER
 
 from libc.stdlib cimport malloc, free
-from libc.string cimport memset
+from libc.string cimport memset, memcpy
+from libc.errno cimport errno, ENOENT, EEXIST, EBUSY, EPERM
+cimport libc.errno
+from cpython.memoryview cimport PyMemoryView_FromMemory
+from cpython.buffer cimport PyBUF_READ
 
 KEY = 0
 VALUE = 1
 
-NO_LOOKUP = [BPF_MAP_TYPE_RINGBUF]
-NO_DELETE = [BPF_MAP_TYPE_RINGBUF]
-NO_GET_NEXT_KEY = [BPF_MAP_TYPE_RINGBUF]
-NO_UPDATE = [BPF_MAP_TYPE_RINGBUF]
+NO_LOOKUP = [BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_BLOOM_FILTER]
+NO_DELETE = [BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_QUEUE, BPF_MAP_TYPE_STACK, BPF_MAP_TYPE_BLOOM_FILTER]
+NO_GET_NEXT_KEY = [BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_QUEUE, BPF_MAP_TYPE_STACK, BPF_MAP_TYPE_BLOOM_FILTER]
+NO_UPDATE = [BPF_MAP_TYPE_RINGBUF, BPF_MAP_TYPE_BLOOM_FILTER]
 
 BPF_RINGBUF_BUSY_BIT        = (1 << 31)
 BPF_RINGBUF_DISCARD_BIT     = (1 << 30)
 BPF_RINGBUF_HDR_SZ          = 8
 
+# default number of elements fetched per batch when dumping a map
+DUMP_CHUNK = 4096
+
+# update flags
+BPF_ANY = 0
+BPF_NOEXIST = 1
+BPF_EXIST = 2
+BPF_F_LOCK = 4
+
+# map flags
+BPF_F_NO_PREALLOC = (1 << 0)
+BPF_F_RDONLY_PROG = (1 << 7)
+BPF_F_WRONLY_PROG = (1 << 8)
+BPF_F_MMAPABLE = (1 << 10)
+
+# kernel internal errno returned for unsupported batch ops
+ENOTSUPP = 524
+
+MAP_IN_MAP = [BPF_MAP_TYPE_ARRAY_OF_MAPS, BPF_MAP_TYPE_HASH_OF_MAPS]
+
+QUEUE_STACK = [BPF_MAP_TYPE_QUEUE, BPF_MAP_TYPE_STACK]
+
+# number of elements popped per batch when draining a queue/stack
+DRAIN_BATCH = 256
+
+# default size of per-cpu perf buffers in pages, must be a power of 2
+PERF_BUFFER_PAGES = 8
+
 
 def buff_copy(dest, src, length):
     '''Copy buffer, works for anything - bytes(), bytearray(), str() and does not get confused
@@ -93,48 +137,77 @@ def produce_template(type_info):
         for item in type_info:
             res = res + produce_template(item)
         return res
+    elif isinstance(type_info, Field):
+        return type_info.format()
     else:
         if type(type_info) is not str:
             raise TypeError
         return type_info
 
-def walk_template(type_info, data, pos):
-    '''Walk a template assigning data as we go along'''
+def walk_template_at(type_info, data, pos, order="="):
+    '''Walk a template assigning data as we go along. Returns the
+    result and the position of the first unused item in data'''
     if type(type_info) is tuple:
-        return {type_info[0]:walk_template(type_info[1], data, pos)}
+        (res, pos) = walk_template_at(type_info[1], data, pos, order)
+        return ({type_info[0]:res}, pos)
     elif type(type_info) is list:
         if type(type_info[0]) is tuple:
             res = {}
+            for item in type_info:
+                (res[item[0]], pos) = walk_template_at(item[1], data, pos, order)
         else:
             res = []
-        for item in type_info:
-            if type(item) is tuple:
-                res[item[0]] = walk_template(item[1], data, pos)
-            else:
-                res.append(walk_template(item, data, pos))
-            pos += 1
-        return res
+            for item in type_info:
+                (value, pos) = walk_template_at(item, data, pos, order)
+                res.append(value)
+        return (res, pos)
+    elif type(type_info) is str:
+        return (data[pos], pos + 1)
     else:
-        return data[pos]
+        return (type_info.decode(data[pos], order), pos + 1)
 
-def do_pack(template, arg):
+def walk_template(type_info, data, pos, order="="):
+    '''Walk a template assigning data as we go along'''
+    return walk_template_at(type_info, data, pos, order)[0]
+
+def do_pack(template, arg, order="="):
 
     to_pack = []
 
     if type(template) is list:
         if type(template[0]) is str:
             to_pack.extend(arg[:len(template)])
+        elif type(template[0]) is tuple:
+            if hasattr(arg, "_fields"):
+                # generated records and named tuples iterate in template order
+                for (item, value) in zip(template, arg):
+                    to_pack.extend(do_pack(item[1], value, order))
+            else:
+                for item in template:
+                    to_pack.extend(do_pack(item[1], arg[item[0]], order))
         else:
-            for item in template:
-                to_pack.extend(do_pack(item[1], arg[item[0]]))
+            for (item, value) in zip(template, arg):
+                to_pack.extend(do_pack(item, value, order))
+    elif type(template) is str:
+        return [arg]
+    elif isinstance(template, Field):
+        return [template.encode(arg, order)]
     else:
-        if type(template) is str:
-            return [arg]
-        else:
-            raise TypeError
+        raise TypeError
     
     return to_pack
 
+def is_flat(json_template):
+    '''Check if a template is a plain list of (name, single item format)'''
+    if type(json_template) is not list:
+        return False
+    for item in json_template:
+        if type(item) is not tuple or type(item[1]) is not str:
+            return False
+        if len(Struct("=" + item[1]).unpack(bytes(calcsize("=" + item[1])))) != 1:
+            return False
+    return True
+
 
 
 class BPFRecord(IterableBuff):
@@ -145,18 +218,42 @@ class BPFRecord(IterableBuff):
         Q is 64 bit long. For more information consult struct documentation
         order is parsing order "=" - machine endian, "<" - little endian
         ">" - big endian, "!" - network byte order.
+        Formats can also be fields.CString or fields.PackedArray for
+        NUL terminated strings and numeric arrays decoded in one go.
+        records - if True, unpack to instances of a generated __slots__
+        class (see records.py) named name instead of to dicts.
     '''
-    def __init__(self, json_template, buff=None, order="="):
+    def __init__(self, json_template, buff=None, order="=", records=False, name="Record"):
 
         self.template = order
+        self.order = order
         self.parsed = {}
         self.json_template = json_template
         self.template += produce_template(self.json_template)
 
         self.compiled = Struct(self.template)
 
+        # flat templates are decoded with a single zip
+        self.names = None
+        if is_flat(self.json_template):
+            self.names = [item[0] for item in self.json_template]
+
+        self.record_class = None
+        self.decoder = None
+        if records:
+            self.record_class = record_class(self.json_template, name)
+            self.decoder = record_decoder(self.record_class, order)
+
         super().__init__(buff, calcsize(self.template))
 
+    def decode(self, data):
+        '''Build a dict (or a record) out of a tuple of unpacked struct values'''
+        if self.decoder is not None:
+            return self.decoder(data)
+        if self.names is not None:
+            return dict(zip(self.names, data))
+        return walk_template(self.json_template, data, 0, self.order)
+
     def unpack(self, buff=None):
         '''Parse the buffer. Buffer is bytes or something that
         behaves like bytes, f.e. cython char*
@@ -170,18 +267,29 @@ class BPFRecord(IterableBuff):
                 raise ValueError
         else:
             data = self.compiled.unpack(buff[:self.compiled.size])
-        return walk_template(self.json_template, data, 0)
+        return self.decode(data)
+
+    def unpack_batch(self, buff, stride=None):
+        '''Parse a buffer holding consecutive records stride bytes
+        apart (by default the record size). Returns a list of dicts.
+        '''
+
+        size = self.compiled.size
+        if stride is None or stride == size:
+            return [self.decode(data) for data in self.compiled.iter_unpack(buff)]
+        return [self.decode(self.compiled.unpack_from(buff, pos))
+                for pos in range(0, len(buff) - size + 1, stride)]
 
 
     def pack(self, arg):
-        '''Build a buffer from a dict according to the
+        '''Build a buffer from a dict or a record according to the
         template. The buffer is a bytes() object.
         '''
 
         if arg is None:
             raise ValueError
 
-        data = do_pack(self.json_template, arg)
+        data = do_pack(self.json_template, arg, self.order)
         try:
             return self.compiled.pack(*data)
         except SError:
@@ -218,6 +326,13 @@ cdef class RingBufferInfo():
         and will not be supported. We cannot use libbpf here, because
         it mandates a C caller, callbacks, epoll and all the rest which
         makes its use "as is" in python not very realistic.
+
+    If anonymous is True, fd is ignored and the buffer is a memfd laid
+    out like the kernel one - consumer page, producer page and the data
+    area mapped twice back to back. Both submit() and the fetch methods
+    work on it, so it can stand in for the kernel without privileges,
+    f.e. for benchmarks. max_entries must be a power of 2 multiple of the
+    page size.
     '''
 
     cdef unsigned char *data
@@ -226,14 +341,64 @@ cdef class RingBufferInfo():
     cdef int record_size
     cdef unsigned long max_entries
     cdef unsigned long mask
+    cdef object view
+    cdef public unsigned long short_records
+    cdef int memfd
 
     cdef int next_rec, next_sz
 
-    def __cinit__(self, fd, max_entries, record_size, map_type):
+    def __cinit__(self, fd, max_entries, record_size, map_type, anonymous=False):
+
+        self.data = NULL
+        self.consumer_pos = NULL
+        self.producer_pos = NULL
+        self.memfd = -1
+
+        if anonymous:
+            self.map_anonymous(max_entries)
+        else:
+            self.map_ring(fd, max_entries, map_type)
+
+        self.record_size = record_size
+        self.max_entries = max_entries
+        self.mask = max_entries - 1
+        self.short_records = 0
+
+        # the data area is mapped twice back to back, so any record can be
+        # decoded in place without worrying about wraparound
+        self.view = PyMemoryView_FromMemory(<char *>self.data, max_entries * 2, PyBUF_READ)
+
+    cdef map_anonymous(self, unsigned long max_entries):
+        '''Map a memfd backed ring with the kernel layout'''
+
+        cdef unsigned long pagesize = getpagesize()
+        cdef unsigned char *area
+
+        if max_entries < pagesize or max_entries & (max_entries - 1):
+            raise ValueError
+
+        self.memfd = os.memfd_create("pybpfmap-ringbuf")
+        os.ftruncate(self.memfd, pagesize * 2 + max_entries)
+
+        self.consumer_pos = <unsigned long *>mmap(<void *>NULL, pagesize, PROT_READ | PROT_WRITE, MAP_SHARED, self.memfd, 0)
+        if self.consumer_pos == MAP_FAILED:
+            raise ValueError
+        self.producer_pos = <unsigned long *>mmap(<void *>NULL, pagesize, PROT_READ | PROT_WRITE, MAP_SHARED, self.memfd, pagesize)
+        if self.producer_pos == MAP_FAILED:
+            raise ValueError
+
+        # reserve room for both copies, then map the data pages twice into it
+        area = <unsigned char *>mmap(<void *>NULL, max_entries * 2, PROT_NONE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0)
+        if area == MAP_FAILED:
+            raise ValueError
+        self.data = area
+        if mmap(<void *>area, max_entries, PROT_READ | PROT_WRITE, MAP_SHARED | MAP_FIXED, self.memfd, pagesize * 2) == MAP_FAILED:
+            raise ValueError
+        if mmap(<void *>(area + max_entries), max_entries, PROT_READ | PROT_WRITE, MAP_SHARED | MAP_FIXED, self.memfd, pagesize * 2) == MAP_FAILED:
+            raise ValueError
 
-        data = NULL
-        consumer_pos = NULL
-        producer_pos = NULL
+    cdef map_ring(self, fd, unsigned long max_entries, map_type):
+        '''Map the ring of a BPF ringbuf map'''
 
         if map_type == BPF_MAP_TYPE_USER_RINGBUF:
             self.consumer_pos = <unsigned long *>mmap(<void *>NULL, getpagesize(), PROT_READ, MAP_SHARED, fd, 0)
@@ -259,22 +424,22 @@ cdef class RingBufferInfo():
         if self.data == MAP_FAILED:
             raise ValueError
 
-        self.record_size = record_size
-        self.max_entries = max_entries
-        self.mask = max_entries - 1
-
 
     cpdef cleanup(self):
         '''Cleanup before de-allocation'''
+        self.view = None
         if self.consumer_pos != NULL and self.consumer_pos != MAP_FAILED:
             munmap(<void *>self.consumer_pos, getpagesize())
             self.consumer_pos = NULL
         if self.producer_pos != NULL and self.producer_pos != MAP_FAILED:
-            munmap(<void *>self.consumer_pos, getpagesize())
+            munmap(<void *>self.producer_pos, getpagesize())
             self.producer_pos = NULL
-        if self.data != NULL and self.producer_pos != MAP_FAILED:
-            munmap(<void *>self.consumer_pos, self.max_entries * 2)
+        if self.data != NULL and self.data != MAP_FAILED:
+            munmap(<void *>self.data, self.max_entries * 2)
             self.data = NULL
+        if self.memfd >= 0:
+            os.close(self.memfd)
+            self.memfd = -1
 
     def __dealloc__(self):
         self.cleanup()
@@ -284,27 +449,31 @@ cdef class RingBufferInfo():
         This is NOT multiple-consumer. There is NOTHING to guard from simultaneous use
         of the same buffers by multiple consumer.
         '''
-        cdef unsigned long length
+        cdef bytes sample = bytes(data)
+        cdef unsigned int length = len(sample)
+        cdef unsigned long int total = roundup(length)
         cdef unsigned long int consumer_pos = smp_load_acquire_long_int(self.consumer_pos, 0)
         cdef unsigned long int producer_pos = smp_load_acquire_long_int(self.producer_pos, 0)
-        cdef char *sample
+        cdef unsigned long int pos
+        cdef unsigned long int hdr_sz = BPF_RINGBUF_HDR_SZ
 
+        if length & (BPF_RINGBUF_BUSY_BIT | BPF_RINGBUF_DISCARD_BIT):
+            raise ValueError
 
-        available = (self.mask + 1) - (producer_pos - consumer_pos)
-
-        length = roundup(len(data) + BPF_RINGBUF_HDR_SZ)
-
-        if length > available:
+        if total > (self.mask + 1) - (producer_pos - consumer_pos):
             return False
 
-        pos = (producer_pos & self.mask)
-        smp_store_release_int(self.data, pos, (length | BPF_RINGBUF_BUSY_BIT))
-        smp_store_release_long_int(self.producer_pos, 0, roundup(producer_pos + length + BPF_RINGBUF_BUSY_BIT) & self.mask)
-        for dbyte in data:
-            self.data[(producer_pos + BPF_RINGBUF_HDR_SZ) & self.mask] = dbyte
-            producer_pos += 1
+        # reserve - the header holds the sample length (without the
+        # header itself) with the busy bit set until the data is in place
+        pos = producer_pos & self.mask
+        smp_store_release_int(self.data, pos, length | BPF_RINGBUF_BUSY_BIT)
+        smp_store_release_int(self.data, pos + 4, 0)
+        smp_store_release_long_int(self.producer_pos, 0, producer_pos + total)
 
-        roundup(producer_pos)
+        # the data area is mapped twice, so the copy can run past the end
+        memcpy(self.data + pos + hdr_sz, <char *>sample, length)
+
+        # commit
         smp_store_release_int(self.data, pos, length)
 
         return True
@@ -326,6 +495,7 @@ cdef class RingBufferInfo():
             while producer_pos > consumer_pos:
                 length = smp_load_acquire_int(<unsigned long *>self.data, consumer_pos & self.mask)
                 if length & BPF_RINGBUF_BUSY_BIT > 0:
+                    smp_store_release_long_int(self.consumer_pos, 0, consumer_pos)
                     return result
 
                 got_new_data = True
@@ -338,14 +508,545 @@ cdef class RingBufferInfo():
             smp_store_release_long_int(self.consumer_pos, 0, consumer_pos);
 
         return result
-        
+
+    cpdef fetch_next_parsed(self, parser, factory=None):
+        '''Fused fetch and decode. Records are decoded with the compiled
+        struct of parser (a BPFRecord) straight out of the mapped ring in
+        one loop, without intermediate bytes() objects. Records come back
+        as dicts built from the parser template if factory is None, as the
+        flat tuple of field values if factory is tuple and as factory(*values)
+        otherwise - f.e. a namedtuple or a class with a matching __init__.
+        Records shorter than the parser are dropped and counted in
+        short_records.
+        '''
+
+        result = list()
+
+        cdef unsigned long int consumer_pos = smp_load_acquire_long_int(self.consumer_pos, 0)
+        cdef unsigned long int producer_pos
+        cdef unsigned long int length
+        cdef unsigned long int size = parser.compiled.size
+        cdef bint as_tuple = factory is tuple
+        cdef bint as_dict = factory is None
+
+        unpack_from = parser.compiled.unpack_from
+        decode = parser.decode
+        view = self.view
+
+        got_new_data = True
+
+        while got_new_data:
+            got_new_data = False
+            producer_pos = smp_load_acquire_long_int(self.producer_pos, 0)
+            while producer_pos > consumer_pos:
+                length = smp_load_acquire_int(<unsigned long *>self.data, consumer_pos & self.mask)
+                if length & BPF_RINGBUF_BUSY_BIT > 0:
+                    smp_store_release_long_int(self.consumer_pos, 0, consumer_pos)
+                    return result
+
+                got_new_data = True
+
+                if length & BPF_RINGBUF_DISCARD_BIT == 0:
+                    if length < size:
+                        self.short_records += 1
+                    else:
+                        values = unpack_from(view, (consumer_pos + BPF_RINGBUF_HDR_SZ) & self.mask)
+                        if as_dict:
+                            result.append(decode(values))
+                        elif as_tuple:
+                            result.append(values)
+                        else:
+                            result.append(factory(*values))
+
+                consumer_pos += roundup(length)
+
+            smp_store_release_long_int(self.consumer_pos, 0, consumer_pos)
+
+        return result
+
+cdef query_map_info(int fd):
+    '''Fetch map parameters from the kernel. Returns a dict with
+    the same keys as the arguments of BPFMap.__init__
+    '''
+    cdef bpf_map_info info
+    cdef unsigned int size = sizeof(bpf_map_info)
+
+    memset(&info, 0, size)
+
+    if bpf_obj_get_info_by_fd(fd, &info, &size) != 0:
+        raise ValueError
+
+    btf_params = None
+    if info.btf_value_type_id != 0 or info.btf_key_type_id !=0:
+        # for some reason kernel params are off by one compared to
+        # what our parser yields from /sys/kernel/btf/vmlinux
+        btf_params = {
+            "id" : info.id,
+            "btf_key_type_id"  : info.btf_key_type_id - 1,
+            "btf_value_type_id" : info.btf_value_type_id - 1,
+            "btf_vmlinux_value_type_id" : info.btf_vmlinux_value_type_id - 1
+        }
+
+    return {
+        "id" : info.id,
+        "map_type" : info.type,
+        "name" : info.name,
+        "key_size" : info.key_size,
+        "value_size" : info.value_size,
+        "max_entries" : info.max_entries,
+        "map_flags" : info.map_flags,
+        "map_extra" : info.map_extra,
+        "btf_params" : btf_params
+    }
+
+def pin_inode(pathname):
+    '''Identity of the object currently pinned at pathname'''
+    stat = os.stat(pathname)
+    return (stat.st_dev, stat.st_ino)
+
+class MapRegistryEntry():
+    '''Kernel map state shared by all BPFMap instances which refer
+    to the same map - the fd, the map info and the parsers.
+    '''
+    def __init__(self, fd, info):
+        self.fd = fd
+        self.info = info
+        self.parsers = [None, None]
+        self.paths = set()
+        self.refcount = 0
+
+def open_map_entry(pathname=None, map_id=None, info=None):
+    '''Open a map by pin path or by id and build an (unregistered)
+    entry for it. If info is supplied, the kernel is not queried
+    for map parameters.
+    '''
+    if pathname is not None:
+        fd = bpf_obj_get(pathname)
+    else:
+        fd = bpf_map_get_fd_by_id(map_id)
+
+    if fd < 0:
+        raise ValueError
+
+    try:
+        if info is None:
+            info = query_map_info(fd)
+    except ValueError:
+        os.close(fd)
+        raise
+
+    return MapRegistryEntry(fd, info)
+
+class MapRegistry():
+    '''Process wide registry of open maps.
+
+    Opens of the same pin path or map id share one fd, map info
+    and parsers. The fd is reference counted and closed when the
+    last user releases it. Pin paths are revalidated by inode, so
+    a pin which has been replaced is re-opened, while the users of
+    the old map keep it until they release it.
+    '''
+    def __init__(self):
+        # reentrant - release() may run out of a __del__ triggered
+        # by the garbage collector while we are holding the lock
+        self.lock = threading.RLock()
+        self.by_path = {}
+        self.by_id = {}
+
+    def register(self, entry, pathname=None, inode=None):
+        '''Add an entry to the indexes. Returns the entry which
+        should be used - if the kernel map is already known, the
+        new fd is closed and the existing entry is returned.
+        '''
+        map_id = entry.info.get("id")
+        existing = self.by_id.get(map_id)
+        if existing is not None and existing is not entry:
+            os.close(entry.fd)
+            entry = existing
+        elif map_id is not None:
+            self.by_id[map_id] = entry
+
+        if pathname is not None:
+            self.by_path[pathname] = (entry, inode)
+            entry.paths.add(pathname)
+
+        entry.refcount += 1
+        return entry
+
+    def forget_path(self, pathname):
+        '''Drop a stale pathname from the index'''
+        (entry, inode) = self.by_path.pop(pathname)
+        entry.paths.discard(pathname)
+
+    def acquire_path(self, pathname, info=None, revalidate=True):
+        '''Get a shared entry for a pinned map. If the map is already
+        open, the only syscall made is a stat() of the pin to check
+        that it has not been replaced. With revalidate=False there
+        are no syscalls at all.
+        '''
+        with self.lock:
+            cached = self.by_path.get(pathname)
+            if cached is not None:
+                (entry, inode) = cached
+                if not revalidate:
+                    entry.refcount += 1
+                    return entry
+                try:
+                    current = pin_inode(pathname)
+                except OSError:
+                    current = None
+                if current == inode:
+                    entry.refcount += 1
+                    return entry
+                self.forget_path(pathname)
+
+            # stat before opening - if the pin is replaced in between
+            # we will notice the inode mismatch on the next open
+            try:
+                inode = pin_inode(pathname)
+            except OSError:
+                raise ValueError
+            entry = open_map_entry(pathname=pathname, info=info)
+            return self.register(entry, pathname, inode)
+
+    def acquire_id(self, map_id):
+        '''Get a shared entry for a map identified by id'''
+        with self.lock:
+            entry = self.by_id.get(map_id)
+            if entry is not None:
+                entry.refcount += 1
+                return entry
+            return self.register(open_map_entry(map_id=map_id))
+
+    def release(self, entry):
+        '''Drop a reference, close the fd when it is the last one'''
+        with self.lock:
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                return
+            for pathname in list(entry.paths):
+                self.forget_path(pathname)
+            map_id = entry.info.get("id")
+            if self.by_id.get(map_id) is entry:
+                del self.by_id[map_id]
+            if entry.fd > 0:
+                os.close(entry.fd)
+                entry.fd = -1
+
+MAP_REGISTRY = MapRegistry()
+
+def online_cpus():
+    '''List of online cpus as per /sys/devices/system/cpu/online'''
+    result = []
+    with open("/sys/devices/system/cpu/online", "r") as online:
+        for item in online.read().strip().split(","):
+            bounds = item.split("-")
+            result.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return result
+
+cdef void ring_copy(void *dest, unsigned char *data, unsigned long int mask,
+                    unsigned long int pos, unsigned long int length):
+    '''Copy out of a ring which is not double mapped, handling wraparound'''
+    cdef unsigned long int start = pos & mask
+    cdef unsigned long int first = length
+
+    if start + length > mask + 1:
+        first = mask + 1 - start
+        memcpy(<char *>dest + first, data, length - first)
+    memcpy(dest, data + start, first)
+
+cdef class PerfBufferInfo():
+    '''Cython class for BPF_MAP_TYPE_PERF_EVENT_ARRAY consumers.
+
+    Opens a PERF_COUNT_SW_BPF_OUTPUT event for each online cpu, maps
+    its ring and inserts the event fd into the map at the cpu index,
+    so bpf_perf_event_output() from the BPF program lands in our rings.
+    All event fds are registered with one epoll instance - use poll()
+    or wait on fileno() in an event framework of choice.
+
+    Lost samples reported by the kernel are accumulated in lost.
+    '''
+
+    cdef int *fds
+    cdef unsigned char **rings
+    cdef char *scratch
+    cdef int count
+    cdef unsigned long mmap_size
+    cdef unsigned long mask
+    cdef public unsigned long lost
+    cdef object epoll
+
+    def __cinit__(self, map_fd, max_entries, pages=PERF_BUFFER_PAGES):
+
+        cdef perf_event_attr attr
+        cdef int fd
+        cdef unsigned int cpu
+
+        cpus = [cpu for cpu in online_cpus() if cpu < max_entries]
+
+        self.count = 0
+        self.lost = 0
+        self.mmap_size = (pages + 1) * getpagesize()
+        self.mask = pages * getpagesize() - 1
+        self.epoll = select.epoll()
+        self.fds = <int *>malloc(sizeof(int) * len(cpus))
+        self.rings = <unsigned char **>malloc(sizeof(unsigned char *) * len(cpus))
+        # a sample can not be bigger than the ring
+        self.scratch = <char *>malloc(self.mask + 1)
+
+        if self.fds == NULL or self.rings == NULL or self.scratch == NULL:
+            raise MemoryError
+
+        if pages & (pages - 1) != 0:
+            raise ValueError
+
+        for cpu in cpus:
+            memset(&attr, 0, sizeof(perf_event_attr))
+            attr.type = PERF_TYPE_SOFTWARE
+            attr.size = sizeof(perf_event_attr)
+            attr.config = PERF_COUNT_SW_BPF_OUTPUT
+            attr.sample_type = PERF_SAMPLE_RAW
+            attr.sample_period = 1
+            attr.wakeup_events = 1
+
+            fd = syscall(SYS_perf_event_open, &attr, -1, cpu, -1, PERF_FLAG_FD_CLOEXEC)
+            if fd < 0:
+                raise OSError(errno, os.strerror(errno))
+
+            self.rings[self.count] = <unsigned char *>mmap(NULL, self.mmap_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0)
+            if self.rings[self.count] == MAP_FAILED:
+                os.close(fd)
+                raise OSError(errno, os.strerror(errno))
+
+            self.fds[self.count] = fd
+            self.count += 1
+
+            if ioctl(fd, PERF_EVENT_IOC_ENABLE, 0) != 0:
+                raise OSError(errno, os.strerror(errno))
+
+            if bpf_map_update_elem(map_fd, &cpu, &fd, 0):
+                raise OSError(errno, os.strerror(errno))
+
+            self.epoll.register(fd, select.EPOLLIN)
+
+    cpdef cleanup(self):
+        '''Cleanup before de-allocation'''
+        cdef int index
+
+        if self.epoll is not None:
+            self.epoll.close()
+            self.epoll = None
+
+        for index in range(0, self.count):
+            munmap(<void *>self.rings[index], self.mmap_size)
+            os.close(self.fds[index])
+        self.count = 0
+
+        free(self.fds)
+        self.fds = NULL
+        free(self.rings)
+        self.rings = NULL
+        free(self.scratch)
+        self.scratch = NULL
+
+    def __dealloc__(self):
+        self.cleanup()
+
+    def fileno(self):
+        '''The epoll fd covering all per-cpu rings'''
+        return self.epoll.fileno()
+
+    cpdef fetch_next_records(self):
+        '''Drain all per-cpu rings, return the samples as bytes()'''
+
+        result = list()
+
+        cdef int index
+        cdef perf_event_mmap_page *header
+        cdef unsigned char *data
+        cdef unsigned long int head
+        cdef unsigned long int tail
+        cdef perf_event_header event
+        cdef unsigned int size
+        cdef unsigned long int lost
+
+        for index in range(0, self.count):
+            header = <perf_event_mmap_page *>self.rings[index]
+            data = self.rings[index] + getpagesize()
+            if header.data_offset != 0:
+                data = self.rings[index] + header.data_offset
+
+            head = smp_load_acquire_long_int(&header.data_head, 0)
+            tail = header.data_tail
+
+            while tail < head:
+                ring_copy(&event, data, self.mask, tail, sizeof(perf_event_header))
+                if event.type == PERF_RECORD_SAMPLE:
+                    ring_copy(&size, data, self.mask, tail + sizeof(perf_event_header), sizeof(unsigned int))
+                    ring_copy(self.scratch, data, self.mask, tail + sizeof(perf_event_header) + sizeof(unsigned int), size)
+                    result.append(bytes(<bytes>self.scratch[:size]))
+                elif event.type == PERF_RECORD_LOST:
+                    # header, u64 id, u64 lost
+                    ring_copy(&lost, data, self.mask, tail + sizeof(perf_event_header) + sizeof(unsigned long int), sizeof(unsigned long int))
+                    self.lost += lost
+                tail += event.size
+
+            smp_store_release_long_int(&header.data_tail, 0, tail)
+
+        return result
+
+    def wait(self, timeout=-1):
+        '''Wait up to timeout seconds for data on any cpu'''
+        self.epoll.poll(timeout)
+
+    def poll(self, timeout=-1):
+        '''Wait up to timeout seconds for data on any cpu, then drain
+        all rings. Returns a list of bytes() samples.
+        '''
+        self.wait(timeout)
+        return self.fetch_next_records()
+
+# Userspace backends (see userspace.py) by pseudo fd. Kernel fds are never
+# negative, so backends are registered under negative ones and BPFMap goes
+# through the map_* wrappers below instead of calling libbpf directly. The
+# wrappers hand fds >= 0 straight to libbpf. Everything else is passed to
+# the backend as bytes() and its OSErrors are turned back into libbpf
+# style -errno returns, so the code above the syscalls runs unchanged.
+BACKENDS = {}
+
+def register_backend(backend):
+    '''Register a userspace backend, returns its pseudo fd'''
+    fd = min(BACKENDS, default=-1) - 1
+    BACKENDS[fd] = backend
+    return fd
+
+cdef int backend_error(int err):
+    '''Fail a wrapped call the way libbpf does'''
+    libc.errno.errno = err
+    return -err
+
+cdef object backend_key(backend, const void *key):
+    '''Key as bytes, None for a NULL key'''
+    if key == NULL:
+        return None
+    return (<char *>key)[:backend.keysize]
+
+cdef inline int map_lookup_elem(int fd, const void *key, void *value):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_lookup_elem(fd, key, value)
+    backend = BACKENDS[fd]
+    try:
+        result = backend.lookup_elem(backend_key(backend, key))
+    except OSError as error:
+        return backend_error(error.errno)
+    memcpy(value, <char *>result, len(result))
+    return 0
+
+cdef inline int map_lookup_and_delete_elem(int fd, const void *key, void *value):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_lookup_and_delete_elem(fd, key, value)
+    backend = BACKENDS[fd]
+    try:
+        result = backend.lookup_and_delete_elem(backend_key(backend, key))
+    except OSError as error:
+        return backend_error(error.errno)
+    memcpy(value, <char *>result, len(result))
+    return 0
+
+cdef inline int map_update_elem(int fd, const void *key, const void *value, unsigned long int flags):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_update_elem(fd, key, value, flags)
+    backend = BACKENDS[fd]
+    try:
+        backend.update_elem(backend_key(backend, key), (<char *>value)[:backend.valuesize], flags)
+    except OSError as error:
+        return backend_error(error.errno)
+    return 0
+
+cdef inline int map_delete_elem(int fd, const void *key):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_delete_elem(fd, key)
+    backend = BACKENDS[fd]
+    try:
+        backend.delete_elem(backend_key(backend, key))
+    except OSError as error:
+        return backend_error(error.errno)
+    return 0
+
+cdef inline int map_get_next_key(int fd, const void *key, void *next_key):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_get_next_key(fd, key, next_key)
+    backend = BACKENDS[fd]
+    try:
+        result = backend.get_next_key(backend_key(backend, key))
+    except OSError as error:
+        return backend_error(error.errno)
+    memcpy(next_key, <char *>result, len(result))
+    return 0
+
+cdef inline int map_freeze(int fd):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_freeze(fd)
+    try:
+        BACKENDS[fd].freeze()
+    except OSError as error:
+        return backend_error(error.errno)
+    return 0
+
+cdef int map_lookup_batch(int fd, void *in_batch, void *out_batch, void *keys, void *values,
+                          unsigned int *count, const bpf_map_batch_opts *opts):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_lookup_batch(fd, in_batch, out_batch, keys, values, count, opts)
+    cdef unsigned int position = 0
+    if in_batch != NULL:
+        memcpy(&position, in_batch, sizeof(unsigned int))
+    (found_keys, found_values, position, err) = BACKENDS[fd].lookup_batch(position, count[0])
+    memcpy(keys, <char *>found_keys, len(found_keys))
+    memcpy(values, <char *>found_values, len(found_values))
+    memcpy(out_batch, &position, sizeof(unsigned int))
+    count[0] = len(found_keys) // BACKENDS[fd].keysize
+    if err:
+        return backend_error(err)
+    return 0
+
+cdef int map_update_batch(int fd, const void *keys, const void *values,
+                          unsigned int *count, const bpf_map_batch_opts *opts):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_update_batch(fd, keys, values, count, opts)
+    backend = BACKENDS[fd]
+    (done, err) = backend.update_batch((<char *>keys)[:count[0] * backend.keysize],
+                                       (<char *>values)[:count[0] * backend.valuesize],
+                                       opts.elem_flags if opts != NULL else 0)
+    if done is not None:
+        count[0] = done
+    if err:
+        return backend_error(err)
+    return 0
+
+cdef int map_delete_batch(int fd, const void *keys, unsigned int *count,
+                          const bpf_map_batch_opts *opts):
+    if fd >= 0 or fd not in BACKENDS:
+        return bpf_map_delete_batch(fd, keys, count, opts)
+    backend = BACKENDS[fd]
+    (done, err) = backend.delete_batch((<char *>keys)[:count[0] * backend.keysize])
+    if done is not None:
+        count[0] = done
+    if err:
+        return backend_error(err)
+    return 0
+
 class BPFMap():
     '''Class representing a BPF Map.
     init takes as arguments fd, maptype, name, keysize, value, max_entries.
     If create is False, map will use the fd passed at init time. If it is
-    True, the map will be created
+    True, the map will be created. If backend is given, the map lives in
+    userspace instead - see userspace.py - and fd is ignored.
     '''
-    def __init__(self, fd, map_type, name, key_size, value_size, max_entries, create=False, btf_params=None):
+
+    # shared registry entry, if the fd is owned by MAP_REGISTRY
+    entry = None
+
+    def __init__(self, fd, map_type, name, key_size, value_size, max_entries, create=False, btf_params=None, map_flags=0, inner_map=None, map_extra=0, backend=None):
 
         cdef bpf_map_create_opts opts
 
@@ -353,38 +1054,101 @@ class BPFMap():
         self.keysize = key_size
         self.valuesize = value_size
         self.map_type = map_type
+        self.name = name
         self.btf_params = btf_params
         self.max_entries = max_entries
+        self.map_flags = map_flags
+        self.map_extra = map_extra
         self.parsers = [None, None]
         self.rb = None
+        self.pb = None
+
+        # publish specific - read-only mmap or immutable dict
+        self.published = None
+
+        # map in map specific - template for inner maps and the inner
+        # maps we have inserted, so their fds stay valid while in use
+        self.inner_map = inner_map
+        self.inner_maps = {}
 
         # ringbuff specific
 
-        if create:
+        if backend is not None:
+            self.fd = register_backend(backend)
+        elif create:
             # We do not support btf_params here. The restrictions on .fd in the opts make
             # this support useable only for someone loading a map out of an elf loader
-            self.fd = bpf_map_create(map_type, name, key_size, value_size, max_entries, NULL)
-
-        if self.fd < 0:
+            memset(&opts, 0, sizeof(bpf_map_create_opts))
+            opts.sz = sizeof(bpf_map_create_opts)
+            opts.map_flags = map_flags
+            # bloom filters - number of hash functions
+            opts.map_extra = map_extra
+            if map_type in MAP_IN_MAP:
+                if inner_map is None:
+                    raise ValueError
+                opts.inner_map_fd = inner_map.fd
+            self.fd = bpf_map_create(map_type, name, key_size, value_size, max_entries, &opts)
+
+        if self.fd < 0 and backend is None:
             raise ValueError
 
         # special case __init__s I should probably rewrite this as a MixIn
         if map_type == BPF_MAP_TYPE_RINGBUF or map_type == BPF_MAP_TYPE_USER_RINGBUF:
             self.rb = RingBufferInfo(self.fd, self.max_entries, value_size, map_type)
 
-    def fetch_next(self, want_parsed=False):
-        '''Ringbuf specific. Fetch the next set of records'''
-        if self.map_type != BPF_MAP_TYPE_RINGBUF:
+    def open_perf_buffer(self, pages=PERF_BUFFER_PAGES):
+        '''Perf event array specific. Start consuming - see PerfBufferInfo.
+        Takes over the map, event fds inserted by others are replaced.
+        '''
+        if self.map_type != BPF_MAP_TYPE_PERF_EVENT_ARRAY:
             raise ValueError
-        result = self.rb.fetch_next_records()
+        if self.pb is not None:
+            self.pb.cleanup()
+        self.pb = PerfBufferInfo(self.fd, self.max_entries, pages)
+
+    def fetch_next(self, want_parsed=False, factory=None):
+        '''Ringbuf and perf event array specific. Fetch the next set of records.
+        If want_parsed is True, records are decoded by the value parser -
+        into dicts, tuples or factory instances, see
+        RingBufferInfo.fetch_next_parsed. Ring buffers decode in place.
+        '''
+        parser = self.parsers[VALUE]
+        if self.map_type == BPF_MAP_TYPE_RINGBUF:
+            if want_parsed and parser is not None:
+                return self.rb.fetch_next_parsed(parser, factory)
+            result = self.rb.fetch_next_records()
+        elif self.map_type == BPF_MAP_TYPE_PERF_EVENT_ARRAY:
+            if self.pb is None:
+                self.open_perf_buffer()
+            result = self.pb.fetch_next_records()
+        else:
+            raise ValueError
+
+        if want_parsed and parser is not None:
+            if factory is None:
+                return [parser.unpack(item) for item in result]
+            if factory is tuple:
+                return [parser.compiled.unpack_from(item) for item in result]
+            return [factory(*parser.compiled.unpack_from(item)) for item in result]
 
-        if want_parsed and (self.parsers[VALUE] is not None):
-            parsed = []
-            for item in result:
-                parsed.append(self.parsers[VALUE].unpack(item))
-            return parsed
+        return result
 
-        return self.rb.fetch_next_records()
+    def poll(self, timeout=-1, want_parsed=False, factory=None):
+        '''Perf event array specific. Wait up to timeout seconds for
+        samples on any cpu and fetch them'''
+        if self.map_type != BPF_MAP_TYPE_PERF_EVENT_ARRAY:
+            raise ValueError
+        if self.pb is None:
+            self.open_perf_buffer()
+        self.pb.wait(timeout)
+        return self.fetch_next(want_parsed, factory)
+
+    def lost_samples(self):
+        '''Perf event array specific. Number of samples the kernel
+        reported as lost so far'''
+        if self.pb is None:
+            return 0
+        return self.pb.lost
 
     def submit(self, value):
         if self.map_type != BPF_MAP_TYPE_USER_RINGBUF:
@@ -394,6 +1158,162 @@ class BPFMap():
         # lookup with fake values - triggers a wake up on all waiters for this map
         self.lookup_elem(bytes(range(0, self.keysize - 1)), bytes(range(0, self.valuesize - 1)))
 
+    def push(self, value, flags=BPF_ANY):
+        '''Queue/stack specific. Push a value. With BPF_EXIST the oldest
+        element is dropped if the map is full.
+        '''
+
+        if self.map_type not in QUEUE_STACK:
+            raise ValueError
+
+        value = self.convert(value, VALUE)
+
+        cdef char *cvalue = <char *>value
+
+        return not map_update_elem(self.fd, NULL, <void *>cvalue, flags)
+
+    def pop(self, want_parsed=False):
+        '''Queue/stack specific. Pop a value, None if the map is empty'''
+        return self.pop_or_peek(True, want_parsed)
+
+    def peek(self, want_parsed=False):
+        '''Queue/stack specific. Return the next value without removing
+        it, None if the map is empty'''
+        return self.pop_or_peek(False, want_parsed)
+
+    def pop_or_peek(self, pop, want_parsed):
+        '''Queue/stack specific. Lookup (and delete) with a NULL key'''
+
+        if self.map_type not in QUEUE_STACK:
+            raise ValueError
+
+        cdef char *cvalue = <char*>malloc(self.valuesize)
+
+        if cvalue == NULL:
+            raise MemoryError
+
+        if pop:
+            ret = map_lookup_and_delete_elem(self.fd, NULL, <void *>cvalue)
+        else:
+            ret = map_lookup_elem(self.fd, NULL, <void *>cvalue)
+
+        result = None
+        if not ret:
+            result = bytes(<bytes>cvalue[:self.valuesize])
+
+        free(cvalue)
+
+        if want_parsed and result is not None:
+            return self.parsers[VALUE].unpack(result)
+
+        return result
+
+    def drain(self, max_items=None, want_parsed=False, batch=DRAIN_BATCH):
+        '''Queue/stack specific. Generator popping up to max_items values
+        (all if None) until the map is empty. Values are popped in a C loop
+        into one reused buffer, batch at a time, and decoded a batch at a
+        time if want_parsed is True. Yields lists of up to batch values -
+        everything popped is handed to the caller, so breaking out of the
+        loop loses nothing.
+        '''
+
+        if self.map_type not in QUEUE_STACK:
+            raise ValueError
+
+        cdef unsigned int valuesize = self.valuesize
+        cdef unsigned int count
+        cdef unsigned int limit
+        cdef char *buff = <char *>malloc(valuesize * batch)
+
+        remaining = max_items
+        try:
+            if buff == NULL:
+                raise MemoryError
+
+            while remaining is None or remaining > 0:
+                limit = batch
+                if remaining is not None and remaining < batch:
+                    limit = remaining
+                count = 0
+                while count < limit and not map_lookup_and_delete_elem(self.fd, NULL, buff + count * valuesize):
+                    count += 1
+                if count == 0:
+                    return
+                if remaining is not None:
+                    remaining -= count
+
+                chunk = buff[:count * valuesize]
+                if want_parsed and self.parsers[VALUE] is not None:
+                    yield self.parsers[VALUE].unpack_batch(chunk, valuesize)
+                else:
+                    yield [chunk[index * valuesize:(index + 1) * valuesize] for index in range(0, count)]
+
+                if count < limit:
+                    return
+        finally:
+            free(buff)
+
+    def bloom_values(self, values):
+        '''Bloom filter specific. Pack a list of values into one buffer'''
+
+        if self.map_type != BPF_MAP_TYPE_BLOOM_FILTER:
+            raise ValueError
+
+        packed = b"".join([self.convert(value, VALUE) for value in values])
+        if len(packed) != len(values) * self.valuesize:
+            raise ValueError
+        return packed
+
+    def add(self, value):
+        '''Bloom filter specific. Add a value'''
+        return self.add_many([value]) == 1
+
+    def add_many(self, values):
+        '''Bloom filter specific. Add a list of values in a C loop.
+        Returns the number of values added.
+        '''
+
+        packed = self.bloom_values(values)
+
+        cdef char *cvalues = <char *>packed
+        cdef unsigned int valuesize = self.valuesize
+        cdef unsigned int total = len(values)
+        cdef unsigned int index
+        cdef unsigned int done = 0
+
+        for index in range(0, total):
+            if not map_update_elem(self.fd, NULL, cvalues + index * valuesize, BPF_ANY):
+                done += 1
+
+        return done
+
+    def might_contain(self, value):
+        '''Bloom filter specific. False if value is definitely not in
+        the filter, True if it may be.
+        '''
+        return self.might_contain_many([value])[0] == 1
+
+    def might_contain_many(self, values):
+        '''Bloom filter specific. Test a list of values in a C loop. Returns
+        a bytearray with 1 for each value which may be in the filter and 0
+        for each one which definitely is not.
+        '''
+
+        packed = self.bloom_values(values)
+        result = bytearray(len(values))
+
+        cdef char *cvalues = <char *>packed
+        cdef unsigned char *cresult = result
+        cdef unsigned int valuesize = self.valuesize
+        cdef unsigned int total = len(values)
+        cdef unsigned int index
+
+        # for bloom filters the probe is passed as the value
+        for index in range(0, total):
+            cresult[index] = not map_lookup_elem(self.fd, NULL, cvalues + index * valuesize)
+
+        return result
+
     def pin_map(self, pathname):
         '''Pin BPF map to pathname specified in the argument'''
 
@@ -407,7 +1327,7 @@ class BPFMap():
 
         if type(value) is bytes:
             cvalue = value
-        elif type(value) is dict or type(value) is list:
+        elif type(value) is dict or type(value) is list or hasattr(value, "_fields"):
             if self.parsers[parser] is None:
                 raise ValueError
             cvalue = self.parsers[parser].pack(value)
@@ -418,10 +1338,11 @@ class BPFMap():
 
         return cvalue
 
-    def update_elem(self, key, value):
+    def update_elem(self, key, value, flags=BPF_ANY):
         '''Update an element supplied as a Python object.
         key and value should be bytes() objects or cython
-        char* pointers.
+        char* pointers. flags is one of BPF_ANY, BPF_NOEXIST
+        or BPF_EXIST.
         '''
 
         if self.map_type in NO_UPDATE:
@@ -433,7 +1354,246 @@ class BPFMap():
         cdef char *ckey = <char *>key
         cdef char *cvalue = <char *>value
 
-        return not bpf_map_update_elem(self.fd, <void *>ckey, <void *>cvalue, 0)
+        return not map_update_elem(self.fd, <void *>ckey, <void *>cvalue, flags)
+
+    def update_batch(self, items, flags=BPF_ANY):
+        '''Update a list of (key, value) pairs in one go. Keys and values
+        can be anything update_elem() accepts. Uses the batch interface if
+        the map supports it, otherwise updates the elements one by one.
+        The kernel accepts only BPF_F_LOCK as a batch flag, so updates with
+        BPF_NOEXIST or BPF_EXIST always go element by element. Elements
+        which fail because of flags (BPF_NOEXIST on an existing key,
+        BPF_EXIST on a missing one) are skipped. Returns the number of
+        elements updated.
+        '''
+
+        if self.map_type in NO_UPDATE:
+            raise ValueError
+
+        keys = b"".join([self.convert(key, KEY) for (key, value) in items])
+        values = b"".join([self.convert(value, VALUE) for (key, value) in items])
+
+        cdef char *ckeys = <char *>keys
+        cdef char *cvalues = <char *>values
+        cdef unsigned int total = len(items)
+        cdef unsigned int offset = 0
+        cdef unsigned int done = 0
+        cdef unsigned int count
+        cdef int ret
+        cdef int err
+        cdef unsigned int keysize = self.keysize
+        cdef unsigned int valuesize = self.valuesize
+        cdef bpf_map_batch_opts opts
+
+        memset(&opts, 0, sizeof(bpf_map_batch_opts))
+        opts.sz = sizeof(bpf_map_batch_opts)
+        opts.elem_flags = flags
+
+        if len(keys) != total * self.keysize or len(values) != total * self.valuesize:
+            raise ValueError
+
+        if not flags & (BPF_NOEXIST | BPF_EXIST):
+            count = total
+            ret = map_update_batch(self.fd, ckeys, cvalues, &count, &opts)
+            err = errno
+            if ret == 0:
+                return count
+            # no batch support for this map type, count is not written back
+            if err != ENOTSUPP:
+                raise OSError(err, os.strerror(err))
+
+        # element by element for flags and for maps without batch support
+        while offset < total:
+            if not map_update_elem(self.fd, ckeys + offset * keysize,
+                                       cvalues + offset * valuesize, flags):
+                done += 1
+            else:
+                err = errno
+                if not ((err == EEXIST and flags == BPF_NOEXIST) or (err == ENOENT and flags == BPF_EXIST)):
+                    raise OSError(err, os.strerror(err))
+            offset += 1
+
+        return done
+
+    def delete_batch(self, keys):
+        '''Delete a list of keys in one go. Keys which are not present
+        are skipped. Returns the number of elements deleted.
+        '''
+
+        if self.map_type in NO_DELETE:
+            raise ValueError
+
+        packed = b"".join([self.convert(key, KEY) for key in keys])
+
+        cdef char *ckeys = <char *>packed
+        cdef unsigned int total = len(keys)
+        cdef unsigned int offset = 0
+        cdef unsigned int done = 0
+        cdef unsigned int count
+        cdef int ret
+        cdef int err
+        cdef unsigned int keysize = self.keysize
+
+        if len(packed) != total * self.keysize:
+            raise ValueError
+
+        while offset < total:
+            count = total - offset
+            ret = map_delete_batch(self.fd, ckeys + offset * keysize, &count, NULL)
+            err = errno
+            if ret == 0:
+                return done + count
+            # no batch support for this map type, count is not written back
+            if err == ENOTSUPP:
+                break
+            done += count
+            offset += count
+            if err != ENOENT:
+                raise OSError(err, os.strerror(err))
+            offset += 1
+
+        while offset < total:
+            if not map_delete_elem(self.fd, ckeys + offset * keysize):
+                done += 1
+            elif errno != ENOENT:
+                raise OSError(errno, os.strerror(errno))
+            offset += 1
+
+        return done
+
+    def sync(self, desired, delete_extra=True, chunk_size=DUMP_CHUNK):
+        '''Bring the map to a desired state. desired is a mapping or an
+        iterable of (key, value) pairs in any form update_elem() accepts.
+        The map is diffed against it in one streaming pass and only the
+        needed changes are applied - deletes first in batches, then updates
+        of existing entries (BPF_EXIST), then new entries (BPF_NOEXIST).
+        Entries not in desired are deleted if delete_extra is True.
+        Returns a dict of counts: added, updated, deleted, unchanged and
+        conflicts - elements which changed under our feet so their
+        BPF_EXIST/BPF_NOEXIST update failed.
+        '''
+
+        if hasattr(desired, "items"):
+            desired = desired.items()
+
+        want = BPFMapSnapshot(self.keysize, self.valuesize, store_values=True)
+        for (key, value) in desired:
+            want.add(self.convert(key, KEY), self.convert(value, VALUE))
+
+        # the snapshot holds the desired state, so the diff is inverted -
+        # ADDED are extra entries in the map, REMOVED are missing ones
+        extra = []
+        missing = []
+        changed = []
+        for (kind, key, wanted, current) in want.diff(chain.from_iterable(self.dump(chunk_size)), update=False):
+            if kind == ADDED:
+                if delete_extra:
+                    extra.append(key)
+            elif kind == REMOVED:
+                missing.append((key, wanted))
+            else:
+                changed.append((key, wanted))
+
+        result = {
+            "added" : 0,
+            "updated" : 0,
+            "deleted" : 0,
+            "unchanged" : len(want) - len(missing) - len(changed),
+            "conflicts" : 0
+        }
+
+        for start in range(0, len(extra), chunk_size):
+            result["deleted"] += self.delete_batch(extra[start:start + chunk_size])
+        for start in range(0, len(changed), chunk_size):
+            chunk = changed[start:start + chunk_size]
+            done = self.update_batch(chunk, BPF_EXIST)
+            result["updated"] += done
+            result["conflicts"] += len(chunk) - done
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            done = self.update_batch(chunk, BPF_NOEXIST)
+            result["added"] += done
+            result["conflicts"] += len(chunk) - done
+
+        return result
+
+    def freeze(self):
+        '''Freeze the map - no further updates via syscalls. BPF programs
+        can still write to it unless it was created with BPF_F_RDONLY_PROG.
+        Freezing an already frozen map succeeds. Freezing fails while the
+        map has writable mmaps.
+        '''
+        if not map_freeze(self.fd):
+            return True
+
+        # A frozen map has lost write permission, so freezing it again
+        # fails the permission check with EPERM. EBUSY means writable
+        # mmaps, EPERM can also be a read-only fd - ask the kernel.
+        cdef int err = errno
+        if (err == EPERM or err == EBUSY) and self.is_frozen():
+            return True
+        # keep the freeze error for the caller
+        libc.errno.errno = err
+        return False
+
+    def is_frozen(self):
+        '''True if the map is frozen, as shown in its fdinfo'''
+        if self.fd in BACKENDS:
+            return BACKENDS[self.fd].frozen
+        with open("/proc/self/fdinfo/{}".format(self.fd), "r") as fdinfo:
+            for line in fdinfo:
+                if line.startswith("frozen:"):
+                    return int(line.split()[1]) != 0
+        return False
+
+    def publish(self, items=None, chunk_size=DUMP_CHUNK):
+        '''Publish a write once map. Bulk load (key, value) pairs from items
+        (if any), freeze the map and from then on serve lookup_elem() locally
+        without syscalls or locking:
+            1. Array maps created with BPF_F_MMAPABLE are read through a
+            read-only mmap of the map values.
+            2. Everything else is dumped once into an immutable dict.
+        Workers which open an already published map call publish() with no
+        items to set up their local view.
+        '''
+
+        if items is not None:
+            if hasattr(items, "items"):
+                items = list(items.items())
+            else:
+                items = list(items)
+            for start in range(0, len(items), chunk_size):
+                self.update_batch(items[start:start + chunk_size])
+
+        if not self.freeze():
+            raise OSError(errno, os.strerror(errno))
+
+        if self.map_type == BPF_MAP_TYPE_ARRAY and self.map_flags & BPF_F_MMAPABLE:
+            # array values are laid out 8 byte aligned
+            stride = (self.valuesize + 7) & ~7
+            size = stride * self.max_entries
+            size = ((size + pymmap.PAGESIZE - 1) // pymmap.PAGESIZE) * pymmap.PAGESIZE
+            self.published = pymmap.mmap(self.fd, size, pymmap.MAP_SHARED, pymmap.PROT_READ)
+        else:
+            self.published = MappingProxyType(dict(chain.from_iterable(self.dump(chunk_size))))
+
+    def lookup_published(self, key, want_parsed):
+        '''Lookup in the local view of a published map'''
+
+        if isinstance(self.published, MappingProxyType):
+            result = self.published.get(key)
+        else:
+            index = int.from_bytes(key[:4], sys.byteorder)
+            if index >= self.max_entries:
+                result = None
+            else:
+                start = index * ((self.valuesize + 7) & ~7)
+                result = self.published[start:start + self.valuesize]
+
+        if want_parsed and result is not None:
+            return self.parsers[VALUE].unpack(result)
+
+        return result
 
     def lookup_elem(self, key, want_parsed=False):
         '''Lookup an element for key. Key must be a bytes() object
@@ -445,10 +1605,13 @@ class BPFMap():
 
         key = self.convert(key, KEY)
 
+        if self.published is not None:
+            return self.lookup_published(key, want_parsed)
+
         cdef char *ckey = <char *>key
         cdef char *cvalue = <char*>malloc(self.valuesize)
 
-        ret = bpf_map_lookup_elem(self.fd, <void*>ckey, <void*>cvalue)
+        ret = map_lookup_elem(self.fd, <void*>ckey, <void*>cvalue)
 
         if ret == 0:
             # note - we build a new bytes() out of the result
@@ -485,7 +1648,7 @@ class BPFMap():
         if cvalue is None:
             raise MemoryError
 
-        if not bpf_map_lookup_and_delete_elem(self.fd, <void *>ckey, <void *>cvalue):
+        if not map_lookup_and_delete_elem(self.fd, <void *>ckey, <void *>cvalue):
             # note - we build a new bytes() out of the result
             # this way we can free our buffer which is malloc'ed
             # and not from the python memory pool.
@@ -498,7 +1661,7 @@ class BPFMap():
         free(cvalue)
 
         if want_parsed:
-            return self.pasers[VALUE].unpack(result)
+            return self.parsers[VALUE].unpack(result)
 
         return result
 
@@ -512,24 +1675,26 @@ class BPFMap():
         key = self.convert(key, KEY)
 
         cdef char *ckey = <char *>key
-        return not bpf_map_delete_elem(self.fd, ckey)
+        return not map_delete_elem(self.fd, ckey)
 
     def get_next_key(self, key):
-        '''Get next key from key based on key supplied as a bytes() object'''
+        '''Get next key from key based on key supplied as a bytes() object.
+        A key of None gives the first key.'''
 
         if self.map_type in NO_GET_NEXT_KEY:
             raise ValueError
 
-        key = self.convert(key, KEY)
-
-        cdef char *ckey = <char *>key
+        cdef char *ckey = NULL
+        if key is not None:
+            key = self.convert(key, KEY)
+            ckey = <char *>key
         cdef char *cnextkey = <char*>malloc(self.keysize)
 
         if cnextkey is None:
             raise MemoryError
 
 
-        if not bpf_map_get_next_key(self.fd, <void *>ckey, <void *>cnextkey):
+        if not map_get_next_key(self.fd, <void *>ckey, <void *>cnextkey):
             # note - we build a new bytes() out of the result
             # this way we can free our buffer which is malloc'ed
             # and not from the python memory pool.
@@ -543,75 +1708,339 @@ class BPFMap():
 
         return result
 
-    def generate_parsers(self, key_pinfo, value_pinfo):
-        '''Generate parsing templates for map key and data'''
+    def dump_raw(self, chunk_size=DUMP_CHUNK):
+        '''Stream the map contents. Yields (count, keys, values) where
+        keys and values are bytes() objects holding count keys and
+        values back to back. Uses the batch lookup interface if the map
+        supports it, otherwise falls back to get_next_key + lookup.
+        '''
+
+        if self.map_type in NO_GET_NEXT_KEY:
+            raise ValueError
+
+        cdef unsigned int count
+        cdef int ret
+        cdef int err
+        cdef unsigned int keysize = self.keysize
+        cdef unsigned int valuesize = self.valuesize
+        # batch tokens are opaque, hash maps use 4 bytes, arrays use the key
+        cdef unsigned int token_size = max(self.keysize, 8)
+        cdef char *keys = <char *>malloc(self.keysize * chunk_size)
+        cdef char *values = <char *>malloc(self.valuesize * chunk_size)
+        cdef char *in_batch = <char *>malloc(token_size)
+        cdef char *out_batch = <char *>malloc(token_size)
+
+        try:
+            if keys == NULL or values == NULL or in_batch == NULL or out_batch == NULL:
+                raise MemoryError
+
+            first = True
+            while True:
+                count = chunk_size
+                if first:
+                    ret = map_lookup_batch(self.fd, NULL, out_batch, keys, values, &count, NULL)
+                else:
+                    ret = map_lookup_batch(self.fd, in_batch, out_batch, keys, values, &count, NULL)
+                err = errno
+                if ret != 0 and err != ENOENT:
+                    if first:
+                        break
+                    raise OSError(err, os.strerror(err))
+
+                first = False
+                if count > 0:
+                    yield (count, keys[:count * keysize], values[:count * valuesize])
+                if ret != 0:
+                    return
+                memcpy(in_batch, out_batch, token_size)
+
+            # batch ops not supported for this map type, walk the keys instead
+            count = 0
+            chunk_keys = bytearray()
+            chunk_values = bytearray()
+            first = True
+            while True:
+                if first:
+                    ret = map_get_next_key(self.fd, NULL, out_batch)
+                else:
+                    ret = map_get_next_key(self.fd, in_batch, out_batch)
+                if ret:
+                    break
+                first = False
+                # the key may have been deleted since get_next_key
+                if not map_lookup_elem(self.fd, out_batch, values):
+                    chunk_keys += out_batch[:keysize]
+                    chunk_values += values[:valuesize]
+                    count += 1
+                    if count >= chunk_size:
+                        yield (count, bytes(chunk_keys), bytes(chunk_values))
+                        count = 0
+                        chunk_keys = bytearray()
+                        chunk_values = bytearray()
+                memcpy(in_batch, out_batch, keysize)
+            if count > 0:
+                yield (count, bytes(chunk_keys), bytes(chunk_values))
+        finally:
+            free(keys)
+            free(values)
+            free(in_batch)
+            free(out_batch)
+
+    def dump(self, chunk_size=DUMP_CHUNK):
+        '''Stream the map contents. Yields lists of up to chunk_size
+        (key, value) tuples of bytes() objects.
+        '''
+
+        keysize = self.keysize
+        valuesize = self.valuesize
+        for (count, keys, values) in self.dump_raw(chunk_size):
+            yield [(keys[index * keysize:(index + 1) * keysize],
+                    values[index * valuesize:(index + 1) * valuesize])
+                    for index in range(0, count)]
+
+    def column_decoders(self):
+        '''ColumnDecoders for the keys and values, columns are named
+        "key.<field>" and "value.<field>" or just "key" and "value"
+        if there is no parser'''
+        return (ColumnDecoder(self.parsers[KEY], "key", self.keysize),
+                ColumnDecoder(self.parsers[VALUE], "value", self.valuesize))
+
+    def iter_columns(self, chunk_size=DUMP_CHUNK):
+        '''Stream the map contents as columns. Yields one dict of
+        column name -> column per chunk, see columns.ColumnDecoder.
+        Each chunk is decoded in bulk.
+        '''
+
+        (key_decoder, value_decoder) = self.column_decoders()
+        for (count, keys, values) in self.dump_raw(chunk_size):
+            result = key_decoder.decode(keys)
+            result.update(value_decoder.decode(values))
+            yield result
+
+    def dump_columns(self, chunk_size=DUMP_CHUNK, numpy=False):
+        '''Dump the whole map as one dict of column name -> column. The
+        columns are array.array objects (bytearray for raw fields) or
+        contiguous numpy arrays if numpy is True.
+        '''
+
+        (key_decoder, value_decoder) = self.column_decoders()
+        if numpy:
+            keys = bytearray()
+            values = bytearray()
+            for (count, chunk_keys, chunk_values) in self.dump_raw(chunk_size):
+                keys += chunk_keys
+                values += chunk_values
+            result = key_decoder.to_numpy(keys)
+            result.update(value_decoder.to_numpy(values))
+            return result
+
+        result = key_decoder.empty()
+        result.update(value_decoder.empty())
+        for (count, keys, values) in self.dump_raw(chunk_size):
+            key_decoder.decode(keys, result)
+            value_decoder.decode(values, result)
+        return result
+
+    def snapshot(self, store_values=False, chunk_size=DUMP_CHUNK):
+        '''Take a compact snapshot of the map contents. If store_values is
+        False only value hashes are kept. See snapshot.BPFMapSnapshot.
+        '''
+
+        snap = BPFMapSnapshot(self.keysize, self.valuesize, store_values)
+        for chunk in self.dump(chunk_size):
+            snap.update(chunk)
+        return snap
+
+    def diff(self, snap, want_parsed=False, update=True, chunk_size=DUMP_CHUNK):
+        '''Compare the map against a snapshot in one pass over the map.
+        Yields (kind, key, old value, new value) tuples for added, removed
+        and changed entries - kind is one of snapshot.ADDED, REMOVED and
+        CHANGED. Old values are None unless the snapshot stores values.
+        Keys and values are decoded by the parsers if want_parsed is True.
+        If update is True, snap moves to the current state of the map.
+        '''
+
+        for (kind, key, old, new) in snap.diff(chain.from_iterable(self.dump(chunk_size)), update):
+            if want_parsed:
+                if self.parsers[KEY] is not None:
+                    key = self.parsers[KEY].unpack(key)
+                if self.parsers[VALUE] is not None:
+                    if old is not None:
+                        old = self.parsers[VALUE].unpack(old)
+                    if new is not None:
+                        new = self.parsers[VALUE].unpack(new)
+            yield (kind, key, old, new)
+
+    def create_like(self, name=None):
+        '''Create a new, empty map with the same type, sizes, flags and
+        parsers as this one. Used to create inner maps from a template.
+        '''
+        if name is None:
+            name = self.name
+        result = BPFMap(-1, self.map_type, name, self.keysize, self.valuesize, self.max_entries,
+                        create=True, map_flags=self.map_flags, inner_map=self.inner_map,
+                        map_extra=self.map_extra)
+        result.parsers = list(self.parsers)
+        return result
+
+    def slot_key(self, slot):
+        '''Map in map specific. Array of maps slots are u32 indexes'''
+        if isinstance(slot, int):
+            return slot.to_bytes(self.keysize, sys.byteorder)
+        return self.convert(slot, KEY)
+
+    def set_inner(self, slot, inner):
+        '''Map in map specific. Point slot of the outer map at the inner
+        map. This is a single update, so the datapath sees either the old
+        or the new inner map, never a mix.
+        '''
+        if self.map_type not in MAP_IN_MAP:
+            raise ValueError
+        key = self.slot_key(slot)
+        if not self.update_elem(key, inner.fd.to_bytes(4, sys.byteorder)):
+            return False
+        self.inner_maps[key] = inner
+        return True
+
+    def get_inner(self, slot):
+        '''Map in map specific. Return the map currently in slot. Inner
+        maps not created by us are opened by id. Returns None for an empty
+        slot.
+        '''
+        if self.map_type not in MAP_IN_MAP:
+            raise ValueError
+        key = self.slot_key(slot)
+        map_id = self.lookup_elem(key)
+        if map_id is None:
+            return None
+        map_id = int.from_bytes(map_id[:4], sys.byteorder)
+        inner = self.inner_maps.get(key)
+        if inner is not None and query_map_info(inner.fd)["id"] == map_id:
+            return inner
+        inner = PinnedBPFMap(None, map_id=map_id)
+        if self.inner_map is not None:
+            inner.parsers[KEY] = self.inner_map.parsers[KEY]
+            inner.parsers[VALUE] = self.inner_map.parsers[VALUE]
+        return inner
+
+    def swap_inner(self, slot, items, name=None, chunk_size=DUMP_CHUNK):
+        '''Map in map specific. Double buffered reload - create a fresh
+        inner map from the template, fill it in bulk with (key, value)
+        pairs from items and flip slot to it with one update. The previous
+        inner map is released once the kernel drops it. Returns the new
+        inner map.
+        '''
+        if self.map_type not in MAP_IN_MAP or self.inner_map is None:
+            raise ValueError
+
+        fresh = self.inner_map.create_like(name)
+        if hasattr(items, "items"):
+            items = items.items()
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                fresh.update_batch(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            fresh.update_batch(chunk)
+
+        if not self.set_inner(slot, fresh):
+            raise ValueError
+        return fresh
+
+    def generate_parsers(self, key_pinfo, value_pinfo, records=False, key_name="Key", value_name="Value"):
+        '''Generate parsing templates for map key and data. If records is
+        True, parsed keys and values are records instead of dicts'''
 
         if key_pinfo is not None:
             try:
-                self.parsers[KEY] = BPFRecord(key_pinfo)
+                self.parsers[KEY] = BPFRecord(key_pinfo, records=records, name=key_name)
             except TypeError:
                 pass
         try:
-            self.parsers[VALUE] = BPFRecord(value_pinfo)
+            self.parsers[VALUE] = BPFRecord(value_pinfo, records=records, name=value_name)
         except TypeError:
             pass
 
-    def generate_parsers_from_btf(self, path="/sys/kernel/btf/vmlinux"):
-        '''Generate parsing templates for map key and data from btf'''
+    def generate_parsers_from_btf(self, path="/sys/kernel/btf/vmlinux", records=False):
+        '''Generate parsing templates for map key and data from btf.
+        Records are named after the BTF types'''
         B = pybpfmap.btfparse.BTFBlob(open(path, "br").read())
         B.parse()
-        key_pinfo = B.elements[self.btf_params["btf_key_type_id"]].generate_pinfo()
-        value_pinfo = B.elements[self.btf_params["btf_value_type_id"]].generate_pinfo()
-        self.generate_parsers(key_pinfo, value_pinfo)
+        # btf_params hold element indexes, the kernel type id - 1
+        key_type = B.elements[self.btf_params["btf_key_type_id"]]
+        value_type = B.elements[self.btf_params["btf_value_type_id"]]
+        self.generate_parsers(key_type.generate_pinfo(), value_type.generate_pinfo(), records,
+                              key_type.name or "Key", value_type.name or "Value")
 
     def __del__(self):
         '''Cleanup and delete the map'''
-        if self.fd > 0:
+        if self.entry is not None:
+            entry = self.entry
+            self.entry = None
+            MAP_REGISTRY.release(entry)
+        elif self.fd > 0:
             os.close(self.fd)
+        else:
+            BACKENDS.pop(self.fd, None)
 
 class PinnedBPFMap(BPFMap):
     '''Class representing a Pinned BPF Map. Takes one argument - pinned
     pathname. Key and value sizes are obtained from the kernel
     using the object info call.
+
+    If pathname is None, the map is opened by map_id instead.
+
+    By default the fd, map info and parsers are shared with all other
+    PinnedBPFMap instances for the same map via MAP_REGISTRY, so opening
+    an already open map costs no bpf syscalls. Shared maps revalidate
+    the pin by inode on each open unless revalidate is False.
+    shared=False gives the map a private fd.
     '''
-    def __init__(self, pathname, map_type=None, name=None, key_size=None, value_size=None, max_entries=None, btf_params=None):
-        cdef bpf_map_info *info = <bpf_map_info *>malloc(sizeof(bpf_map_info))
-        cdef unsigned int size = sizeof(bpf_map_info)
+    def __init__(self, pathname, map_type=None, name=None, key_size=None, value_size=None, max_entries=None, btf_params=None, map_id=None, shared=True, revalidate=True):
 
         if isinstance(pathname, str):
             self.pathname = pathname.encode("ascii")
         else:
             self.pathname = pathname
 
-        try:
-            self.fd = -1
-            fd = bpf_obj_get(self.pathname)
+        self.fd = -1
 
-            if fd < 0:
-                raise ValueError
+        info = None
+        if map_type is not None:
+            info = {
+                "map_type" : map_type,
+                "name" : name,
+                "key_size" : key_size,
+                "value_size" : value_size,
+                "max_entries" : max_entries,
+                "btf_params" : btf_params
+            }
+
+        if self.pathname is None and map_id is None:
+            raise ValueError
 
-            if map_type is not None:
-                info.type = map_type
-                info.key_size = key_size
-                info.value_size = value_size
-                info.max_entries = max_entries
-                err = 0
+        if shared:
+            if self.pathname is not None:
+                entry = MAP_REGISTRY.acquire_path(self.pathname, info=info, revalidate=revalidate)
             else:
-                err = bpf_obj_get_info_by_fd(fd, info, &size)
+                entry = MAP_REGISTRY.acquire_id(map_id)
+        else:
+            entry = open_map_entry(pathname=self.pathname, map_id=map_id, info=info)
 
-            if err != 0:
-                raise ValueError
+        info = entry.info
+
+        try:
+            super().__init__(entry.fd, info["map_type"], info["name"], info["key_size"], info["value_size"], info["max_entries"], create=False, btf_params=info["btf_params"], map_flags=info.get("map_flags", 0), map_extra=info.get("map_extra", 0))
+        except ValueError:
+            self.fd = -1
+            if shared:
+                MAP_REGISTRY.release(entry)
             else:
-                if info.btf_value_type_id != 0 or info.btf_key_type_id !=0:
-                    # for some reason kernel params are off by one compared to
-                    # what our parser yields from /sys/kernel/btf/vmlinux
-                    btf_params = {
-                        "id" : info.id,
-                        "btf_key_type_id"  : info.btf_key_type_id - 1,
-                        "btf_value_type_id" : info.btf_value_type_id - 1,
-                        "btf_vmlinux_value_type_id" : info.btf_vmlinux_value_type_id - 1
-                    }
-                super().__init__(fd, info.type, info.name, info.key_size, info.value_size, info.max_entries, create=False, btf_params=btf_params)
+                os.close(entry.fd)
+            raise
 
-        finally:
-            free(info)
+        if shared:
+            self.entry = entry
+            self.parsers = entry.parsers
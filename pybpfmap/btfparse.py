@@ -10,6 +10,7 @@
 
 from struct import Struct, calcsize
 import sys
+from pybpfmap.fields import CString, PackedArray, ARRAY_CODES
 
 IS_64 = (int.bit_length(sys.maxsize) + 1 == 64)
 
@@ -103,6 +104,12 @@ REF_TYPES = [BTFKIND_CONST, BTFKIND_VOLATILE, BTFKIND_RESTRICT,
 QUAL_TYPES = [BTFKIND_CONST, BTFKIND_VOLATILE, BTFKIND_RESTRICT,
              BTFKIND_VAR, BTFKIND_DECL_TAG, BTFKIND_TYPE_TAG]
 
+# kinds which take their layout from the type they refer to
+ALIAS_TYPES = QUAL_TYPES + [BTFKIND_TYPEDEF]
+
+BTF_INT_SIGNED = 1 << 0
+BTF_INT_CHAR = 1 << 1
+
 
 class BTFBase():
     '''Class representing a single BTF Record'''
@@ -136,14 +143,29 @@ class BTFBase():
         else:
             self.data["type_id"] = size_or_type
 
-        if IS_64:
+        if kind in ALIAS_TYPES:
+            self.template = None
+        elif IS_64:
             self.template = "Q"
         else:
             self.template = "I"
 
     def generate_pinfo(self):
         '''Generate a tuple to form a high level parser'''
-        return [(self.name, self.generate_template())]
+        return [(self.name, self.generate_field())]
+
+    def generate_field(self):
+        '''Generate the parser info for a value of this type when it
+        is a struct member or an array element'''
+        if self.tid in ALIAS_TYPES:
+            return self.rtype.generate_field()
+        return self.generate_template()
+
+    def strip_qualifiers(self):
+        '''The type without const/volatile/etc. Typedefs are kept'''
+        if self.tid in QUAL_TYPES:
+            return self.rtype.strip_qualifiers()
+        return self
 
     def set_size(self, arg):
         '''Size setter'''
@@ -225,7 +247,7 @@ class BTFBase():
         else:
             fmat = "I"
 
-        if self.tid in QUAL_TYPES:
+        if self.tid in ALIAS_TYPES:
             self.template = self.rtype.generate_template()
         else:
             self.template = fmat
@@ -269,9 +291,14 @@ class BTFInt(BTFBase):
             elif  self.data["int_bits"] == 64:
                 self.template = 'q'
 
-            if self.data["int_encoding"] & (1 << 0) == 0:
+            if self.data["int_encoding"] & BTF_INT_SIGNED == 0:
                 self.template = self.template.capitalize()
 
+    def is_char(self):
+        '''Check if this is a character type'''
+        return self.data["int_bits"] == 8 and \
+            (self.name == "char" or self.data["int_encoding"] & BTF_INT_CHAR != 0)
+
 
 
 class BTFArray(BTFBase):
@@ -320,6 +347,23 @@ class BTFArray(BTFBase):
             pass
         return self.template
 
+    def generate_field(self):
+        '''char arrays are parsed as strings, other numeric arrays as
+        packed arrays, anything else - arrays of structs, unions or
+        arrays - as a list with one item per element'''
+
+        element = self.data["array_type"].strip_qualifiers()
+        nelems = self.data["nelems"]
+        if element.tid == BTFKIND_INT and element.is_char():
+            return CString(nelems)
+        temp = element.generate_template()
+        if temp in ARRAY_CODES:
+            return PackedArray(temp, nelems)
+        field = element.generate_field()
+        if field is None:
+            return None
+        return [field] * nelems
+
 class BTFStruct(BTFBase):
     '''Struct/Union init'''
     def __init__(self, kind=None, vlen=0, kind_flag=False,
@@ -358,7 +402,9 @@ class BTFStruct(BTFBase):
             return self.template
 
         fmat = ""
-        if self.tid == BTFKIND_STRUCT and len(self.data["members"]) > 0:
+        if self.tid == BTFKIND_UNION:
+            fmat = "{}s".format(self.size)
+        elif len(self.data["members"]) > 0:
             try:
                 for item in self.data["members"]:
                     fmat += item["type"].generate_template()
@@ -372,11 +418,20 @@ class BTFStruct(BTFBase):
         result = []
         try:
             for item in self.data["members"]:
-                result.append((item["name"],item["type"].generate_template()))
+                field = item["type"].generate_field()
+                if field is None:
+                    return None
+                result.append((item["name"], field))
         except TypeError:
             return None
         return result
 
+    def generate_field(self):
+        '''Structs nest, unions are left as raw bytes'''
+        if self.tid == BTFKIND_UNION:
+            return self.generate_template()
+        return self.generate_pinfo()
+
 class BTFEnum(BTFBase):
     '''Enum Init'''
     def __init__(self, kind=None, vlen=0, kind_flag=False, size_or_type=0,
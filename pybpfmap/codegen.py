@@ -0,0 +1,193 @@
+'''Ahead of time generation of parser modules from BTF'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+import argparse
+import hashlib
+from pprint import pformat
+
+from pybpfmap.btfparse import BTFBlob, BTFKIND_FWD, BTFKIND_STRUCT, BTFKIND_UNION, ALIAS_TYPES
+from pybpfmap.bpfrecord import BPFRecord
+
+VMLINUX = "/sys/kernel/btf/vmlinux"
+
+# The generated module only needs struct and the field types to describe
+# the layouts. BPFRecord is imported when a parser is first requested.
+TEMPLATE = """\'\'\'Parsers generated by pybpfmap.codegen from {btf_path}. Do not edit.\'\'\'
+
+import hashlib
+import warnings
+from pybpfmap.fields import CString, PackedArray
+
+BTF_PATH = {btf_path!r}
+BTF_SHA256 = {btf_hash!r}
+
+# type name -> struct format, BTF size, member byte offsets and parser info
+TYPES = {types}
+
+# map name -> (key type, value type)
+MAPS = {maps}
+
+PARSERS = {{}}
+
+# result of the first check() done by parser()/attach(), None until then
+CHECKED = None
+
+def check(path=BTF_PATH, strict=False):
+    \'\'\'Check that the BTF the module was generated from matches path.
+    Returns True if it does. A mismatch is reported as a warning, or
+    as a ValueError if strict is True.\'\'\'
+    with open(path, "rb") as btf:
+        digest = hashlib.sha256(btf.read()).hexdigest()
+    if digest == BTF_SHA256:
+        return True
+    message = "{{}} does not match the BTF this module was generated from".format(path)
+    if strict:
+        raise ValueError(message)
+    warnings.warn(message)
+    return False
+
+def check_once():
+    \'\'\'check() the running kernel on first use, the result is cached.
+    A missing BTF file is reported the same way as a mismatch.\'\'\'
+    global CHECKED
+    if CHECKED is None:
+        try:
+            CHECKED = check()
+        except OSError as error:
+            warnings.warn("cannot check {{}}: {{}}".format(BTF_PATH, error))
+            CHECKED = False
+    return CHECKED
+
+def parser(name, records=False, check_btf=True):
+    \'\'\'BPFRecord for a type, cached. Unless check_btf is False, the
+    BTF is checked against the running kernel on first use.\'\'\'
+    from pybpfmap.bpfrecord import BPFRecord
+    if check_btf:
+        check_once()
+    result = PARSERS.get((name, records))
+    if result is None:
+        result = BPFRecord(TYPES[name]["pinfo"], records=records, name=name)
+        PARSERS[(name, records)] = result
+    return result
+
+def attach(bpf_map, name, records=False, check_btf=True):
+    \'\'\'Set up the key and value parsers of a BPFMap for map name.
+    Unless check_btf is False, the BTF is checked against the running
+    kernel on first use.\'\'\'
+    if check_btf:
+        check_once()
+    (key_type, value_type) = MAPS[name]
+    key_pinfo = None
+    if key_type is not None:
+        key_pinfo = TYPES[key_type]["pinfo"]
+    bpf_map.generate_parsers(key_pinfo, TYPES[value_type]["pinfo"], records,
+                             key_type or "Key", value_type)
+"""
+
+def btf_hash(buff):
+    '''sha256 of BTF data as a hex string'''
+    return hashlib.sha256(buff).hexdigest()
+
+def find_type(blob, name):
+    '''Find a complete (not forward declared) type by name'''
+    for element in blob.elements:
+        if element.name == name and element.tid != BTFKIND_FWD:
+            return element
+    raise ValueError("no type {} in BTF".format(name))
+
+def resolve_aliases(btf_type):
+    '''Follow typedefs and qualifiers down to the actual type'''
+    while btf_type.tid in ALIAS_TYPES:
+        btf_type = btf_type.rtype
+    return btf_type
+
+def type_info(btf_type):
+    '''Format, size, layout and parser info for a type'''
+    actual = resolve_aliases(btf_type)
+    offsets = {}
+    if actual.tid == BTFKIND_STRUCT:
+        pinfo = actual.generate_pinfo()
+        for member in actual.data["members"]:
+            offset = member["offset"]
+            if actual.tid_flag:
+                # the top 8 bits are the bitfield size
+                offset = offset & 0xffffff
+            offsets[member["name"]] = offset // 8
+    elif actual.tid == BTFKIND_UNION:
+        pinfo = [(btf_type.name, actual.generate_field())]
+    else:
+        pinfo = btf_type.generate_pinfo()
+    if pinfo is None:
+        raise ValueError("cannot generate a parser for {}".format(btf_type.name))
+
+    result = {
+        "format": BPFRecord(pinfo).template,
+        "pinfo": pinfo,
+        "offsets": offsets
+    }
+    if actual.has_size:
+        result["size"] = actual.size
+    return result
+
+def generate_module(blob, types=(), maps=None, btf_path=VMLINUX, btf_sha256=None):
+    '''Generate the source of a parser module.
+    blob - parsed BTFBlob
+    types - names of the types to include
+    maps - dict of map name -> (key type name or None, value type name),
+    the types are added to the module automatically.
+    btf_sha256 - hash to stamp the module with, computed from the blob
+    data by default.
+    '''
+    if maps is None:
+        maps = {}
+    if btf_sha256 is None:
+        btf_sha256 = btf_hash(blob.buff)
+
+    names = list(types)
+    for (key_type, value_type) in maps.values():
+        for name in (key_type, value_type):
+            if name is not None and name not in names:
+                names.append(name)
+
+    infos = {}
+    for name in names:
+        infos[name] = type_info(find_type(blob, name))
+
+    return TEMPLATE.format(btf_path=btf_path, btf_hash=btf_sha256,
+                           types=pformat(infos, sort_dicts=False),
+                           maps=pformat(dict(maps)))
+
+def write_module(output, types=(), maps=None, btf_path=VMLINUX):
+    '''Parse the BTF at btf_path and write a parser module to output'''
+    with open(btf_path, "rb") as btf:
+        blob = BTFBlob(btf.read())
+    blob.parse()
+    source = generate_module(blob, types, maps, btf_path)
+    with open(output, "w") as module:
+        module.write(source)
+
+def main():
+    '''Command line entry point'''
+    args = argparse.ArgumentParser(description="Generate a parser module from BTF")
+    args.add_argument("-o", "--output", required=True, help="module file to write")
+    args.add_argument("-b", "--btf", default=VMLINUX, help="BTF file")
+    args.add_argument("-m", "--map", action="append", default=[],
+                      help="map as name:key_type:value_type, key_type can be empty")
+    args.add_argument("types", nargs="*", help="type names")
+    args = args.parse_args()
+
+    maps = {}
+    for spec in args.map:
+        (name, key_type, value_type) = spec.split(":")
+        maps[name] = (key_type or None, value_type)
+    write_module(args.output, args.types, maps, args.btf)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+'''Columnar (struct of arrays) decoding of map dumps'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from array import array
+from struct import calcsize
+import re
+
+from pybpfmap.fields import ARRAY_CODES, NATIVE, CString, PackedArray
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORMAT_ITEM = re.compile(r"(\d*)([a-zA-Z?])")
+
+# struct codes -> numpy type codes, the byte order is prepended
+NUMPY_CODES = {
+    "b": "i1", "B": "u1", "?": "?",
+    "h": "i2", "H": "u2",
+    "i": "i4", "I": "u4", "l": "i4", "L": "u4",
+    "q": "i8", "Q": "u8",
+    "e": "f2", "f": "f4", "d": "f8"
+}
+
+NUMPY_ORDER = {"=": "=", "@": "=", "<": "<", ">": ">", "!": ">"}
+
+def split_format(fmat):
+    '''Split a struct format into one format per unpacked item'''
+    result = []
+    for (count, code) in FORMAT_ITEM.findall(fmat):
+        if code == "x":
+            continue
+        if code in "sp":
+            result.append(count + code)
+        else:
+            result.extend([code] * int(count or 1))
+    return result
+
+def leaves(template, path):
+    '''Flatten a BPFRecord template into (path, format or Field) with
+    one entry per unpacked struct item. Struct members are joined with
+    ".", array elements are suffixed with [index].
+    '''
+    if type(template) is tuple:
+        return leaves(template[1], path)
+    if type(template) is list:
+        result = []
+        for (idx, item) in enumerate(template):
+            if type(item) is tuple:
+                result.extend(leaves(item[1], "{}.{}".format(path, item[0])))
+            else:
+                result.extend(leaves(item, "{}[{}]".format(path, idx)))
+        return result
+    if type(template) is str:
+        items = split_format(template)
+        if len(items) == 1:
+            return [(path, items[0])]
+        return [("{}[{}]".format(path, idx), item) for (idx, item) in enumerate(items)]
+    return [(path, template)]
+
+def leaf_format(leaf):
+    '''Struct format of a leaf'''
+    if type(leaf) is str:
+        return leaf
+    return leaf.format()
+
+def empty_column(leaf):
+    '''An empty column of the right type for a leaf'''
+    if isinstance(leaf, PackedArray):
+        return array(ARRAY_CODES[leaf.code])
+    if type(leaf) is str and leaf in ARRAY_CODES:
+        return array(ARRAY_CODES[leaf])
+    if leaf in ("?", "e"):
+        return array("B" if leaf == "?" else "f")
+    return bytearray()
+
+class ColumnDecoder():
+    '''Decode buffers of back to back records into columns.
+
+    There is one column per leaf item of the template. Numeric leaves
+    are array.array columns. Strings, unions and other raw leaves are
+    bytearray columns holding the fixed width items back to back.
+    PackedArray leaves are array.array columns of count items per
+    record. If parser is None, the whole record is one raw column
+    named prefix.
+    '''
+    def __init__(self, parser, prefix, size=None):
+        if parser is None:
+            self.compiled = None
+            self.order = "="
+            self.leaves = [(prefix, "{}s".format(size))]
+            self.size = size
+        else:
+            self.compiled = parser.compiled
+            self.order = parser.order
+            self.leaves = leaves(parser.json_template, prefix)
+            self.size = parser.compiled.size
+
+    def names(self):
+        '''Column names in template order'''
+        return [path for (path, leaf) in self.leaves]
+
+    def empty(self):
+        '''A dict of empty columns'''
+        return {path:empty_column(leaf) for (path, leaf) in self.leaves}
+
+    def decode(self, buff, columns=None):
+        '''Decode buff (a whole number of records) and append the result
+        to columns (a dict as returned by empty()). Returns columns.
+        '''
+        if columns is None:
+            columns = self.empty()
+        if len(buff) == 0:
+            return columns
+        if self.compiled is None:
+            columns[self.leaves[0][0]] += buff
+            return columns
+
+        # transpose the whole chunk at once, one tuple per leaf
+        items = zip(*self.compiled.iter_unpack(buff))
+        for ((path, leaf), values) in zip(self.leaves, items):
+            column = columns[path]
+            if type(column) is bytearray:
+                column += b"".join(values)
+            elif isinstance(leaf, PackedArray):
+                start = len(column)
+                column.frombytes(b"".join(values))
+                if self.order not in NATIVE:
+                    swapped = column[start:]
+                    swapped.byteswap()
+                    column[start:] = swapped
+            else:
+                column.extend(values)
+        return columns
+
+    def numpy_dtype(self):
+        '''numpy structured dtype matching the record layout'''
+        order = NUMPY_ORDER[self.order]
+        names = []
+        formats = []
+        offsets = []
+        fmat = self.order
+        for (path, leaf) in self.leaves:
+            names.append(path)
+            offsets.append(calcsize(fmat))
+            fmat += leaf_format(leaf)
+            if isinstance(leaf, PackedArray):
+                formats.append((order + NUMPY_CODES[leaf.code], (leaf.count,)))
+            elif isinstance(leaf, CString):
+                formats.append("S{}".format(leaf.size))
+            elif type(leaf) is str and leaf in NUMPY_CODES:
+                formats.append(order + NUMPY_CODES[leaf])
+            else:
+                formats.append("V{}".format(calcsize("=" + leaf_format(leaf))))
+        return numpy.dtype({"names":names, "formats":formats,
+                            "offsets":offsets, "itemsize":self.size})
+
+    def to_numpy(self, buff):
+        '''Decode buff into a dict of contiguous numpy arrays. The data
+        is interpreted in place and each column is copied out once.
+        '''
+        if numpy is None:
+            raise ImportError("numpy is not available")
+        records = numpy.frombuffer(buff, dtype=self.numpy_dtype())
+        return {path:numpy.ascontiguousarray(records[path]) for path in self.names()}
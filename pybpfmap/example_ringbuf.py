@@ -15,6 +15,7 @@
 
 from pybpfmap.bpfrecord import BPFMap, PinnedBPFMap
 from pybpfmap.map_types import BPF_MAP_TYPE_RINGBUF
+from pybpfmap.fields import CString
 
 from os import unlink, chmod
 import sys
@@ -30,7 +31,7 @@ PIN="/sys/fs/bpf/test_ringbuf"
 #	char filename[MAX_FILENAME_LEN];
 #};
 
-PARSER_DEF = [("pid", "l"), ("task", "16s"), ("filename", "512s")]
+PARSER_DEF = [("pid", "l"), ("task", CString(16)), ("filename", CString(512))]
 
 def setup_ringbuf():
     '''Test Filtered map access'''
@@ -44,15 +45,9 @@ def setup_ringbuf():
     m.generate_parsers(None, PARSER_DEF)
     return m
 
-def strip_nulls(arg):
-    return arg[:arg.find(b'\0')]
-
-
 def get_events(m):
     events = m.fetch_next(want_parsed=True)
     for event in events:
-        event["task"] = strip_nulls(event["task"])
-        event["filename"] = strip_nulls(event["filename"])
         print("{}".format(event))
 
 m = setup_ringbuf()
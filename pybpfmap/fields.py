@@ -0,0 +1,128 @@
+'''Special field kinds for BPFRecord templates'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from array import array
+from struct import calcsize
+import sys
+
+# array typecodes by struct format code - struct uses standard sizes
+# with an explicit byte order, array always uses native sizes
+ARRAY_CODES = {}
+for fmt in "bBhHiIlLqQfd":
+    for code in "bBhHiIlLqQfd":
+        if (code.lower() == code) == (fmt.lower() == fmt) and \
+           (code in "fd") == (fmt in "fd") and \
+           array(code).itemsize == calcsize("=" + fmt):
+            ARRAY_CODES.setdefault(fmt, code)
+
+if sys.byteorder == "little":
+    NATIVE = ["=", "@", "<"]
+else:
+    NATIVE = ["=", "@", ">", "!"]
+
+class Field():
+    '''Base class for template fields which are one struct item
+    but decode to something other than the raw struct value'''
+
+    def format(self):
+        '''Struct format for the field'''
+        raise NotImplementedError
+
+    def decode(self, raw, order="="):
+        '''Convert the raw struct value'''
+        raise NotImplementedError
+
+    def encode(self, value, order="="):
+        '''Convert a value to something struct can pack'''
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        return hash(repr(self))
+
+class CString(Field):
+    '''char name[size] holding a NUL terminated string. Decoded up to
+    the first NUL - to bytes() or to str if an encoding is given.
+    '''
+    def __init__(self, size, encoding=None):
+        self.size = size
+        self.encoding = encoding
+
+    def format(self):
+        return "{}s".format(self.size)
+
+    def decode(self, raw, order="="):
+        end = raw.find(b"\0")
+        if end >= 0:
+            raw = raw[:end]
+        if self.encoding is not None:
+            return raw.decode(self.encoding, errors="replace")
+        return raw
+
+    def encode(self, value, order="="):
+        # struct zero pads or truncates to the field size
+        if isinstance(value, str):
+            return value.encode(self.encoding or "ascii")
+        return value
+
+    def __repr__(self):
+        if self.encoding is None:
+            return "CString({})".format(self.size)
+        return "CString({}, {!r})".format(self.size, self.encoding)
+
+class PackedArray(Field):
+    '''type name[count] of a numeric struct format code. Decoded as
+    one array.array, or as a read-only memoryview if view is True,
+    instead of count separate Python objects. The view is over the bytes
+    object struct unpacks for the field - a copy, not the record data -
+    so it saves the array.array allocation and copy, not the unpack one.
+    Views are only possible in native byte order.
+    '''
+    def __init__(self, code, count, view=False):
+        if code not in ARRAY_CODES:
+            raise TypeError
+        self.code = code
+        self.count = count
+        self.view = view
+
+    def itemsize(self):
+        '''Size of one element'''
+        return calcsize("=" + self.code)
+
+    def format(self):
+        return "{}s".format(self.count * self.itemsize())
+
+    def decode(self, raw, order="="):
+        if self.view and order in NATIVE:
+            return memoryview(raw).cast(ARRAY_CODES[self.code])
+        result = array(ARRAY_CODES[self.code])
+        result.frombytes(raw)
+        if order not in NATIVE:
+            result.byteswap()
+        return result
+
+    def encode(self, value, order="="):
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value)
+        if isinstance(value, memoryview):
+            value = array(ARRAY_CODES[self.code], value.tolist())
+        elif not isinstance(value, array):
+            value = array(ARRAY_CODES[self.code], value)
+        if order not in NATIVE:
+            value = array(value.typecode, value)
+            value.byteswap()
+        return value.tobytes()
+
+    def __repr__(self):
+        if self.view:
+            return "PackedArray({!r}, {}, view=True)".format(self.code, self.count)
+        return "PackedArray({!r}, {})".format(self.code, self.count)
@@ -0,0 +1,199 @@
+'''LPM trie key encoding, bulk prefix loading and userspace lookups'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+import ipaddress
+from socket import inet_pton, AF_INET, AF_INET6
+from struct import Struct
+from itertools import chain
+
+# struct bpf_lpm_trie_key - u32 prefixlen in host order, followed by
+# the data (address) in network order
+PREFIXLEN = Struct("=I")
+PREFIXLEN_SIZE = PREFIXLEN.size
+
+# number of prefixes per update_batch() call when loading
+LOAD_CHUNK = 4096
+
+def prefix_mask(bits, prefixlen):
+    '''Integer mask for the leading prefixlen bits out of bits'''
+    return ((1 << bits) - 1) ^ ((1 << (bits - prefixlen)) - 1)
+
+def parse_prefix(prefix):
+    '''Turn a prefix into (packed address, prefixlen). Accepts strings
+    ("10.0.0.0/8", "2001:db8::/32", a bare address means a host route),
+    ipaddress networks and addresses and (address, prefixlen) tuples.
+    Host bits are cleared.
+    '''
+    if isinstance(prefix, str):
+        (address, slash, prefixlen) = prefix.partition("/")
+        if ":" in address:
+            packed = inet_pton(AF_INET6, address)
+        else:
+            packed = inet_pton(AF_INET, address)
+        if slash:
+            prefixlen = int(prefixlen)
+        else:
+            prefixlen = len(packed) * 8
+    elif isinstance(prefix, tuple):
+        (address, prefixlen) = prefix
+        if isinstance(address, bytes):
+            packed = address
+        else:
+            packed = ipaddress.ip_address(address).packed
+    elif isinstance(prefix, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        packed = prefix.network_address.packed
+        prefixlen = prefix.prefixlen
+    else:
+        packed = ipaddress.ip_address(prefix).packed
+        prefixlen = len(packed) * 8
+
+    bits = len(packed) * 8
+    if prefixlen < 0 or prefixlen > bits:
+        raise ValueError
+    if prefixlen < bits:
+        packed = (int.from_bytes(packed, "big") & prefix_mask(bits, prefixlen)).to_bytes(len(packed), "big")
+    return (packed, prefixlen)
+
+def encode_prefix(prefix, key_size=None):
+    '''Encode a prefix as a LPM trie key. If key_size is given, the key
+    is zero padded to it.
+    '''
+    (packed, prefixlen) = parse_prefix(prefix)
+    key = PREFIXLEN.pack(prefixlen) + packed
+    if key_size is not None:
+        if len(key) > key_size:
+            raise ValueError
+        key = key + bytes(key_size - len(key))
+    return key
+
+def decode_prefix(key, address_size=None):
+    '''Decode a LPM trie key into an ipaddress network. The address
+    size (4 or 16) is derived from the key size unless given.
+    '''
+    (prefixlen,) = PREFIXLEN.unpack_from(key)
+    if address_size is None:
+        address_size = len(key) - PREFIXLEN_SIZE
+    address = key[PREFIXLEN_SIZE:PREFIXLEN_SIZE + address_size]
+    return ipaddress.ip_network((address, prefixlen))
+
+def read_prefixes(source):
+    '''Stream prefixes out of a file name or a file object. One prefix
+    per line, optionally followed by whitespace and a value which is
+    returned as a string. Empty lines and # comments are skipped.
+    Yields (prefix, value or None).
+    '''
+    if isinstance(source, str):
+        with open(source, "r") as prefixes:
+            yield from read_prefixes(prefixes)
+        return
+    for line in source:
+        line = line.split("#", 1)[0].strip()
+        if len(line) == 0:
+            continue
+        fields = line.split(None, 1)
+        if len(fields) > 1:
+            yield (fields[0], fields[1])
+        else:
+            yield (fields[0], None)
+
+def load_prefixes(bpf_map, prefixes, value=None, chunk_size=LOAD_CHUNK):
+    '''Load prefixes into a LPM trie map in batches.
+
+    prefixes is an iterable of prefixes or (prefix, value) pairs, a file
+    name or a file object (see read_prefixes). value is used for
+    entries which do not carry their own value (value None); if it
+    is callable it is called with (prefix, value) and the result is
+    stored. Values can be in any form update_elem() accepts. Each chunk
+    is one update_batch() call - a single syscall on kernels with batch
+    ops for LPM tries, the per element loop on older ones.
+    Returns the number of entries loaded.
+    '''
+    if isinstance(prefixes, str) or hasattr(prefixes, "readline"):
+        prefixes = read_prefixes(prefixes)
+
+    loaded = 0
+    chunk = []
+    for item in prefixes:
+        # (address, prefixlen) tuples are prefixes, not (prefix, value) pairs
+        if isinstance(item, tuple) and len(item) == 2 and not isinstance(item[1], int):
+            (prefix, item_value) = item
+        else:
+            (prefix, item_value) = (item, None)
+        if callable(value):
+            item_value = value(prefix, item_value)
+        elif item_value is None:
+            item_value = value
+        chunk.append((encode_prefix(prefix, bpf_map.keysize), item_value))
+        if len(chunk) >= chunk_size:
+            loaded += bpf_map.update_batch(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        loaded += bpf_map.update_batch(chunk)
+    return loaded
+
+class LPMTable():
+    '''Userspace longest prefix match over a set of prefixes, f.e. a
+    dump of a LPM trie map, for verification. Entries are kept in one
+    dict per prefix length, a lookup probes the lengths longest first.
+    '''
+    def __init__(self, entries=None, address_size=None):
+        self.address_size = address_size
+        self.tables = {}
+        self.lengths = []
+        if entries is not None:
+            self.update(entries)
+
+    @classmethod
+    def from_map(cls, bpf_map, address_size=None):
+        '''Build a table out of the current contents of a LPM trie map'''
+        return cls(chain.from_iterable(bpf_map.dump()), address_size)
+
+    def add(self, prefix, value):
+        '''Add a prefix. prefix is anything encode_prefix() accepts
+        or a raw LPM trie key as bytes()'''
+        if isinstance(prefix, bytes):
+            (prefixlen,) = PREFIXLEN.unpack_from(prefix)
+            size = self.address_size
+            if size is None:
+                size = len(prefix) - PREFIXLEN_SIZE
+            packed = prefix[PREFIXLEN_SIZE:PREFIXLEN_SIZE + size]
+        else:
+            (packed, prefixlen) = parse_prefix(prefix)
+        bits = len(packed) * 8
+        table = self.tables.get((bits, prefixlen))
+        if table is None:
+            table = {}
+            self.tables[(bits, prefixlen)] = table
+            self.lengths = sorted(self.tables.keys(), key=lambda item: item[1], reverse=True)
+        table[int.from_bytes(packed, "big")] = value
+
+    def update(self, entries):
+        '''Add (prefix, value) pairs from an iterable'''
+        for (prefix, value) in entries:
+            self.add(prefix, value)
+
+    def lookup(self, address):
+        '''Longest prefix match for an address. Returns
+        (ipaddress network, value) or None.
+        '''
+        if isinstance(address, bytes):
+            packed = address
+        else:
+            packed = ipaddress.ip_address(address).packed
+        bits = len(packed) * 8
+        address = int.from_bytes(packed, "big")
+        for (width, prefixlen) in self.lengths:
+            if width != bits:
+                continue
+            masked = address & prefix_mask(bits, prefixlen)
+            table = self.tables[(width, prefixlen)]
+            if masked in table:
+                return (ipaddress.ip_network((masked.to_bytes(len(packed), "big"), prefixlen)), table[masked])
+        return None
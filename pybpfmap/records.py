@@ -0,0 +1,142 @@
+'''Compact record classes generated from BPFRecord templates'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from keyword import iskeyword
+
+class Record():
+    '''Base class for generated record classes. Instances hold one
+    slot per template field and iterate over the field values in
+    template order, the same as named tuples do.
+    '''
+    __slots__ = ()
+    _fields = ()
+    _nested = {}
+
+    def __init__(self, *args):
+        for (name, value) in zip(self._fields, args):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        for name in self._fields:
+            yield getattr(self, name)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,
+            ", ".join("{}={!r}".format(name, getattr(self, name)) for name in self._fields))
+
+    def _asdict(self):
+        '''Convert to the nested dict form BPFRecord.unpack() returns'''
+        return {name:as_dict(getattr(self, name)) for name in self._fields}
+
+def as_dict(value):
+    '''Convert record values (including lists of records) to dicts'''
+    if isinstance(value, Record):
+        return value._asdict()
+    if type(value) is list:
+        return [as_dict(item) for item in value]
+    return value
+
+def is_struct(template):
+    '''Check if a template describes a struct - a list of (name, format)'''
+    return type(template) is list and len(template) > 0 and type(template[0]) is tuple
+
+def attribute_name(name, idx):
+    '''Turn a template field name into a valid attribute name'''
+    if name is None or not name.isidentifier():
+        return "_{}".format(idx)
+    if iskeyword(name):
+        return name + "_"
+    if name.startswith("__"):
+        # __name would be mangled by the class machinery
+        return "_" + name.lstrip("_")
+    return name
+
+def element_template(template):
+    '''Find the struct template inside (possibly nested) arrays'''
+    while type(template) is list and len(template) > 0 and not is_struct(template):
+        template = template[0]
+    if is_struct(template):
+        return template
+    return None
+
+def record_class(template, name="Record"):
+    '''Generate a __slots__ class for a struct template. Nested structs,
+    and structs inside arrays, get classes of their own, named after
+    the parent class and the field.
+    '''
+    if not is_struct(template):
+        raise TypeError
+
+    fields = []
+    nested = {}
+    for (idx, item) in enumerate(template):
+        attribute = attribute_name(item[0], idx)
+        if attribute in fields:
+            attribute = "_{}".format(idx)
+        fields.append(attribute)
+        inner = element_template(item[1])
+        if inner is not None:
+            nested[attribute] = record_class(inner, name + "_" + attribute)
+
+    # a generated constructor is several times faster than setattr()
+    source = "def __init__(__self, {}):\n".format(", ".join(fields))
+    for attribute in fields:
+        source += "    __self.{0} = {0}\n".format(attribute)
+    namespace = {}
+    exec(source, namespace)
+
+    return type(name, (Record,), {
+        "__slots__": tuple(fields),
+        "__init__": namespace["__init__"],
+        "_fields": tuple(fields),
+        "_nested": nested,
+        "_template": template
+    })
+
+def build_expression(cls, template, namespace, pos):
+    '''Build a Python expression constructing the value for template out
+    of the unpacked struct items in "data" starting at pos.
+    Returns the expression and the position of the next unused item.
+    '''
+    if is_struct(template):
+        cname = "C{}".format(len(namespace))
+        namespace[cname] = cls
+        args = []
+        for (item, attribute) in zip(template, cls._fields):
+            (expr, pos) = build_expression(cls._nested.get(attribute), item[1], namespace, pos)
+            args.append(expr)
+        return ("{}({})".format(cname, ", ".join(args)), pos)
+    if type(template) is list:
+        items = []
+        for item in template:
+            (expr, pos) = build_expression(cls, item, namespace, pos)
+            items.append(expr)
+        return ("[{}]".format(", ".join(items)), pos)
+    if type(template) is str:
+        return ("data[{}]".format(pos), pos + 1)
+    fname = "F{}".format(len(namespace))
+    namespace[fname] = template
+    return ("{}.decode(data[{}], order)".format(fname, pos), pos + 1)
+
+def record_decoder(cls, order="="):
+    '''Generate a function building an instance of cls (and its nested
+    records) out of a tuple of unpacked struct items in one expression.
+    '''
+    namespace = {"order": order}
+    (expr, pos) = build_expression(cls, cls._template, namespace, 0)
+    source = "def decode(data):\n    return {}\n".format(expr)
+    exec(source, namespace)
+    return namespace["decode"]
@@ -0,0 +1,176 @@
+'''Compact snapshots of BPF map contents'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from array import array
+
+ADDED = 0
+REMOVED = 1
+CHANGED = 2
+
+MIN_INDEX = 16
+
+class BPFMapSnapshot():
+    '''Compact snapshot of raw map contents.
+
+    Keys are stored back to back in one bytearray. Values are stored
+    the same way if store_values is True, otherwise only a 64 bit hash
+    of each value is kept. Lookups go through an open addressing table
+    of entry numbers which is kept at most half full, so the overhead
+    on top of the raw keys is 16-24 bytes per entry in hash mode.
+
+    Hashes are produced by hash() and are only valid for the lifetime
+    of the process - a snapshot cannot be persisted.
+    '''
+    def __init__(self, key_size, value_size, store_values=False, capacity=0):
+        self.key_size = key_size
+        self.value_size = value_size
+        self.store_values = store_values
+        self.count = 0
+        self.keys = bytearray()
+        if store_values:
+            self.values = bytearray()
+        else:
+            self.values = array("q")
+        size = MIN_INDEX
+        while size < capacity * 2:
+            size = size * 2
+        self.index = array("i", [0]) * size
+
+    def __len__(self):
+        return self.count
+
+    def key_at(self, idx):
+        '''Key of entry idx'''
+        return bytes(self.keys[idx * self.key_size:(idx + 1) * self.key_size])
+
+    def value_at(self, idx):
+        '''Value of entry idx, None if values are not stored'''
+        if not self.store_values:
+            return None
+        return bytes(self.values[idx * self.value_size:(idx + 1) * self.value_size])
+
+    def find_slot(self, key):
+        '''Find the index slot for key - either the one holding it
+        or the empty one where it should be inserted'''
+        index = self.index
+        keys = self.keys
+        key_size = self.key_size
+        mask = len(index) - 1
+        pos = hash(key) & mask
+        while True:
+            entry = index[pos]
+            if entry == 0:
+                return pos
+            start = (entry - 1) * key_size
+            if keys[start:start + key_size] == key:
+                return pos
+            pos = (pos + 1) & mask
+
+    def find(self, key):
+        '''Entry number for key or -1 if not present'''
+        return self.index[self.find_slot(key)] - 1
+
+    def grow(self):
+        '''Double the index and rehash'''
+        self.index = array("i", [0]) * (len(self.index) * 2)
+        mask = len(self.index) - 1
+        for idx in range(0, self.count):
+            pos = hash(self.key_at(idx)) & mask
+            while self.index[pos] != 0:
+                pos = (pos + 1) & mask
+            self.index[pos] = idx + 1
+
+    def add(self, key, value):
+        '''Add or replace an entry. Key and value are bytes()'''
+        if (self.count + 1) * 2 > len(self.index):
+            self.grow()
+        pos = self.find_slot(key)
+        entry = self.index[pos]
+        if entry == 0:
+            self.keys += key
+            if self.store_values:
+                self.values += value
+            else:
+                self.values.append(hash(value))
+            self.count += 1
+            self.index[pos] = self.count
+        else:
+            idx = entry - 1
+            if self.store_values:
+                self.values[idx * self.value_size:(idx + 1) * self.value_size] = value
+            else:
+                self.values[idx] = hash(value)
+
+    def update(self, items):
+        '''Add (key, value) pairs from an iterable'''
+        for (key, value) in items:
+            self.add(key, value)
+
+    def get(self, key):
+        '''Value stored for key - bytes() if values are stored, the
+        value hash otherwise. None if key is not present.
+        '''
+        idx = self.find(key)
+        if idx < 0:
+            return None
+        if self.store_values:
+            return self.value_at(idx)
+        return self.values[idx]
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def items(self):
+        '''Iterate over (key, value) pairs. Value is None if
+        values are not stored'''
+        for idx in range(0, self.count):
+            yield (self.key_at(idx), self.value_at(idx))
+
+    def changed(self, idx, value):
+        '''Check if the value for entry idx differs from value'''
+        if self.store_values:
+            start = idx * self.value_size
+            return self.values[start:start + self.value_size] != value
+        return self.values[idx] != hash(value)
+
+    def diff(self, items, update=True):
+        '''Compare against (key, value) pairs from an iterable in one pass.
+        Yields (kind, key, old value, new value) tuples where kind is one
+        of ADDED, REMOVED, CHANGED. Old values are None unless values are
+        stored. If update is True, the snapshot is advanced to the new
+        state once the generator is exhausted, so the next diff is
+        incremental.
+        '''
+        seen = bytearray(self.count)
+        fresh = None
+        if update:
+            fresh = BPFMapSnapshot(self.key_size, self.value_size, self.store_values, self.count)
+
+        for (key, value) in items:
+            if fresh is not None:
+                fresh.add(key, value)
+            idx = self.find(key)
+            if idx < 0:
+                yield (ADDED, key, None, value)
+            else:
+                seen[idx] = 1
+                if self.changed(idx, value):
+                    yield (CHANGED, key, self.value_at(idx), value)
+
+        idx = seen.find(0)
+        while idx >= 0:
+            yield (REMOVED, self.key_at(idx), self.value_at(idx), None)
+            idx = seen.find(0, idx + 1)
+
+        if fresh is not None:
+            self.count = fresh.count
+            self.keys = fresh.keys
+            self.values = fresh.values
+            self.index = fresh.index
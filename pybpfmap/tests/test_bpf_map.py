@@ -13,14 +13,19 @@
 # You may select, at your option, one of the above-listed licenses.
 
 
-from pybpfmap.bpfrecord import BPFMap
-from pybpfmap.map_types import BPF_MAP_TYPE_HASH
+from pybpfmap.bpfrecord import BPFMap, PinnedBPFMap, online_cpus
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_ARRAY_OF_MAPS, BPF_MAP_TYPE_QUEUE
+from pybpfmap.map_types import BPF_MAP_TYPE_BLOOM_FILTER, BPF_MAP_TYPE_ARRAY, BPF_MAP_TYPE_LPM_TRIE
+from pybpfmap.map_types import BPF_MAP_TYPE_PERF_EVENT_ARRAY
+from pybpfmap.bpfrecord import BPF_F_MMAPABLE, BPF_F_NO_PREALLOC
+from pybpfmap.lpm import load_prefixes, LPMTable
 
 from nose.tools import ok_ as assert_
 from nose.tools import raises
 from nose.tools import assert_equal
 from nose.tools import assert_is_none
 from os import unlink
+from itertools import chain
 
 TESTSEQ = "0102030405060708090a0b0c0d0e0f00"
 TESTKEY = bytes.fromhex(TESTSEQ)
@@ -90,3 +95,173 @@ def test_elements_3():
     assert_equal(l["data"][6],TESTDATA_ARRAY["data"][6])
     assert_equal(l["data"][7],TESTDATA_ARRAY["data"][7])
     
+
+def test_shared_pin():
+    '''Opens of the same pin share one fd'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_HASH, "test_shared".encode("ascii"), 16, 64, 256, create=True)
+    try:
+        unlink("/sys/fs/bpf/test_shared")
+    except OSError:
+        pass
+    assert_(m.pin_map("/sys/fs/bpf/test_shared".encode("ascii")))
+    assert_(m.update_elem(TESTKEY, TESTDATA))
+
+    p1 = PinnedBPFMap("/sys/fs/bpf/test_shared")
+    p2 = PinnedBPFMap("/sys/fs/bpf/test_shared")
+    assert_equal(p1.fd, p2.fd)
+    assert_equal(p1.entry.refcount, 2)
+
+    p3 = PinnedBPFMap(None, map_id=p1.entry.info["id"])
+    assert_equal(p1.fd, p3.fd)
+    assert_equal(p3.lookup_elem(TESTKEY), TESTDATA)
+
+    # replace the pin - next open must pick up the new map
+    unlink("/sys/fs/bpf/test_shared")
+    n = BPFMap(1, BPF_MAP_TYPE_HASH, "test_shared".encode("ascii"), 16, 64, 256, create=True)
+    assert_(n.pin_map("/sys/fs/bpf/test_shared".encode("ascii")))
+    p4 = PinnedBPFMap("/sys/fs/bpf/test_shared")
+    assert_(p4.fd != p1.fd)
+    assert_is_none(p4.lookup_elem(TESTKEY))
+    unlink("/sys/fs/bpf/test_shared")
+
+def test_sync():
+    '''Bring a map to a desired state'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_HASH, "test_sync".encode("ascii"), 16, 64, 256, create=True)
+    m.generate_parsers([("uid", "Q"), ("gid", "Q")], [("data", ["Q","Q","Q","Q","Q","Q","Q","Q"])])
+    for uid in range(0, 10):
+        assert_(m.update_elem({"uid": uid, "gid": 1}, TESTDATA_ARRAY))
+
+    desired = [({"uid": uid, "gid": 1}, TESTDATA_ARRAY) for uid in range(5, 15)]
+    desired[0] = ({"uid": 5, "gid": 1}, {"data": [7, 6, 5, 4, 3, 2, 1, 0]})
+
+    result = m.sync(desired)
+    assert_equal(result["added"], 5)
+    assert_equal(result["updated"], 1)
+    assert_equal(result["deleted"], 5)
+    assert_equal(result["unchanged"], 4)
+    assert_equal(result["conflicts"], 0)
+
+    assert_is_none(m.lookup_elem({"uid": 0, "gid": 1}))
+    assert_equal(m.lookup_elem({"uid": 5, "gid": 1}, want_parsed=True)["data"][0], 7)
+    assert_equal(m.lookup_elem({"uid": 14, "gid": 1}, want_parsed=True)["data"][1], 1)
+
+    result = m.sync(desired)
+    assert_equal(result["unchanged"], 10)
+
+def test_swap_inner():
+    '''Double buffered reload via map in map'''
+
+    t = BPFMap(1, BPF_MAP_TYPE_HASH, "test_inner".encode("ascii"), 16, 64, 256, create=True)
+    o = BPFMap(1, BPF_MAP_TYPE_ARRAY_OF_MAPS, "test_outer".encode("ascii"), 4, 4, 2, create=True, inner_map=t)
+
+    first = o.swap_inner(0, {TESTKEY: TESTDATA})
+    assert_equal(o.get_inner(0).lookup_elem(TESTKEY), TESTDATA)
+
+    second = o.swap_inner(0, [])
+    assert_(first.fd != second.fd)
+    assert_is_none(o.get_inner(0).lookup_elem(TESTKEY))
+    assert_is_none(o.get_inner(1))
+
+def test_perf_buffer():
+    '''Open a perf event array consumer'''
+
+    cpus = online_cpus()
+    m = BPFMap(1, BPF_MAP_TYPE_PERF_EVENT_ARRAY, "test_perf".encode("ascii"), 4, 4, max(cpus) + 1, create=True)
+    m.open_perf_buffer()
+    assert_equal(m.fetch_next(), [])
+    assert_equal(m.poll(0), [])
+    assert_equal(m.lost_samples(), 0)
+
+    # perf event arrays can not be read from userspace, only deleting
+    # a slot which holds an event fd succeeds
+    for cpu in cpus:
+        assert_(m.delete(cpu.to_bytes(4, "little")))
+        assert_(not m.delete(cpu.to_bytes(4, "little")))
+
+def test_queue():
+    '''Push, pop and drain a queue'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_QUEUE, "test_queue".encode("ascii"), 0, 8, 1024, create=True)
+    m.generate_parsers(None, [("seq", "Q")])
+    for seq in range(0, 1000):
+        assert_(m.push({"seq": seq}))
+
+    assert_equal(m.peek(want_parsed=True)["seq"], 0)
+    assert_equal(m.pop(want_parsed=True)["seq"], 0)
+    assert_equal([item["seq"] for item in chain.from_iterable(m.drain(max_items=10, want_parsed=True))], list(range(1, 11)))
+    assert_equal(len(list(chain.from_iterable(m.drain()))), 989)
+    assert_is_none(m.pop())
+
+def test_drain_break():
+    '''Breaking out of drain loses no values'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_QUEUE, "test_drain".encode("ascii"), 0, 8, 1024, create=True)
+    m.generate_parsers(None, [("seq", "Q")])
+    for seq in range(0, 100):
+        assert_(m.push({"seq": seq}))
+
+    taken = []
+    for items in m.drain(want_parsed=True, batch=16):
+        taken.extend(items)
+        break
+    assert_equal(len(taken), 16)
+    rest = list(chain.from_iterable(m.drain(want_parsed=True)))
+    assert_equal([item["seq"] for item in taken + rest], list(range(0, 100)))
+
+def test_bloom():
+    '''Bloom filter membership'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_BLOOM_FILTER, "test_bloom".encode("ascii"), 0, 8, 1024, create=True, map_extra=3)
+    assert_(m.add((1).to_bytes(8, "little")))
+    assert_equal(m.add_many([item.to_bytes(8, "little") for item in range(2, 100)]), 98)
+    assert_(m.might_contain((50).to_bytes(8, "little")))
+
+    result = m.might_contain_many([item.to_bytes(8, "little") for item in range(1, 200)])
+    assert_equal(len(result), 199)
+    assert_equal(sum(result[:99]), 99)
+
+def test_lpm_load():
+    '''Bulk load prefixes into a LPM trie'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_LPM_TRIE, "test_lpm".encode("ascii"), 8, 4, 256, create=True, map_flags=BPF_F_NO_PREALLOC)
+    prefixes = [("10.{}.0.0".format(idx), 16) for idx in range(0, 100)] + ["10.0.0.0/8"]
+    assert_equal(load_prefixes(m, prefixes, value=bytes(4), chunk_size=16), 101)
+    assert_equal(sum([len(chunk) for chunk in m.dump()]), 101)
+
+    t = LPMTable.from_map(m)
+    assert_equal(str(t.lookup("10.5.1.1")[0]), "10.5.0.0/16")
+    assert_equal(str(t.lookup("10.200.1.1")[0]), "10.0.0.0/8")
+
+def test_publish():
+    '''Publish write once maps'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_HASH, "test_publish".encode("ascii"), 16, 64, 256, create=True)
+    m.publish({TESTKEY: TESTDATA})
+    assert_(not m.update_elem(TESTKEY, TESTDATA))
+    assert_(m.freeze())
+    assert_(m.is_frozen())
+    assert_equal(m.lookup_elem(TESTKEY), TESTDATA)
+
+    a = BPFMap(1, BPF_MAP_TYPE_ARRAY, "test_publish".encode("ascii"), 4, 12, 16, create=True, map_flags=BPF_F_MMAPABLE)
+    a.publish([((3).to_bytes(4, "little"), TESTKEY[:12])])
+    assert_equal(a.lookup_elem((3).to_bytes(4, "little")), TESTKEY[:12])
+    assert_equal(a.lookup_elem((4).to_bytes(4, "little")), bytes(12))
+    assert_is_none(a.lookup_elem((16).to_bytes(4, "little")))
+
+def test_dump_columns():
+    '''Dump a map as columns'''
+
+    m = BPFMap(1, BPF_MAP_TYPE_HASH, "test_columns".encode("ascii"), 16, 64, 256, create=True)
+    m.generate_parsers([("uid", "Q"), ("gid", "Q")], [("data", ["Q","Q","Q","Q","Q","Q","Q","Q"])])
+    for uid in range(0, 100):
+        assert_(m.update_elem({"uid": uid, "gid": 1}, TESTDATA_ARRAY))
+
+    result = m.dump_columns(chunk_size=16)
+    assert_equal(sorted(result["key.uid"]), list(range(0, 100)))
+    assert_equal(list(result["key.gid"]), [1] * 100)
+    assert_equal(len(result["value.data[7]"]), 100)
+
+    chunks = list(m.iter_columns(chunk_size=16))
+    assert_equal(sum([len(chunk["key.uid"]) for chunk in chunks]), 100)
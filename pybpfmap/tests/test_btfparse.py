@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+
+'''BTF parser info generation test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from nose.tools import ok_ as assert_
+from nose.tools import assert_equal
+
+from pybpfmap.btfparse import BTFBlob, BTFKIND_INT, BTFKIND_ARRAY, BTFKIND_STRUCT
+from pybpfmap.btfparse import BTFKIND_TYPEDEF, BTFKIND_CONST, BTF_INT_SIGNED
+from pybpfmap.btfparse import BTFHEADER, BTFTYPE, BTFINT, BTFARRAY, BTFSTRUCT
+from pybpfmap.bpfrecord import BPFRecord
+from pybpfmap.fields import CString, PackedArray
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH
+from pybpfmap.userspace import UserspaceMap
+
+import tempfile
+
+BTF_MAGIC = 0xeb9f
+
+class BTFBuilder():
+    '''Minimal BTF writer for test fixtures'''
+    def __init__(self):
+        self.strings = bytearray(b"\0")
+        self.types = bytearray()
+
+    def name(self, text):
+        '''Add a string, returns its offset'''
+        offset = len(self.strings)
+        self.strings.extend(text.encode("ascii") + b"\0")
+        return offset
+
+    def header(self, name, kind, vlen, size_or_type):
+        '''Add a type header, name may be None for anonymous types'''
+        name_off = 0
+        if name is not None:
+            name_off = self.name(name)
+        self.types.extend(BTFTYPE.pack(name_off, (kind << 24) | vlen, size_or_type))
+
+    def members(self, members):
+        '''Add struct members as (name, type id, bit offset)'''
+        for (member, tid, offset) in members:
+            self.types.extend(BTFSTRUCT.pack(self.name(member), tid, offset))
+
+    def blob(self):
+        '''The complete BTF data'''
+        return BTFHEADER.pack(BTF_MAGIC, 1, 0, BTFHEADER.size, 0, len(self.types),
+                              len(self.types), len(self.strings)) + bytes(self.types) + bytes(self.strings)
+
+def matrix_btf():
+    '''BTF for struct matrix { u32 a; u32 m[2][3]; u32 b; }'''
+
+    btf = BTFBuilder()
+    btf.header("u32", BTFKIND_INT, 0, 4)
+    btf.types.extend(BTFINT.pack(32))
+    # 2: u32[3], 3: u32[2][3]
+    btf.header(None, BTFKIND_ARRAY, 0, 0)
+    btf.types.extend(BTFARRAY.pack(1, 1, 3))
+    btf.header(None, BTFKIND_ARRAY, 0, 0)
+    btf.types.extend(BTFARRAY.pack(2, 1, 2))
+    btf.header("matrix", BTFKIND_STRUCT, 3, 32)
+    btf.members([("a", 1, 0), ("m", 3, 32), ("b", 1, 224)])
+    return btf.blob()
+
+def nested_btf():
+    '''BTF for
+        typedef unsigned int u32;
+        struct inner { u32 id; const u32 flags; char comm[16]; };
+        struct outer { u32 id; struct inner inner; };
+    '''
+
+    btf = BTFBuilder()
+    btf.header("unsigned int", BTFKIND_INT, 0, 4)
+    btf.types.extend(BTFINT.pack(32))
+    btf.header("char", BTFKIND_INT, 0, 1)
+    btf.types.extend(BTFINT.pack((BTF_INT_SIGNED << 24) | 8))
+    btf.header("u32", BTFKIND_TYPEDEF, 0, 1)
+    btf.header(None, BTFKIND_ARRAY, 0, 0)
+    btf.types.extend(BTFARRAY.pack(2, 1, 16))
+    btf.header(None, BTFKIND_CONST, 0, 3)
+    # 6: struct inner, 7: struct outer
+    btf.header("inner", BTFKIND_STRUCT, 3, 24)
+    btf.members([("id", 3, 0), ("flags", 5, 32), ("comm", 4, 64)])
+    btf.header("outer", BTFKIND_STRUCT, 2, 28)
+    btf.members([("id", 3, 0), ("inner", 6, 32)])
+    return btf.blob()
+
+def test_nested_array():
+    '''Multi-dimensional arrays are one field per member'''
+
+    blob = BTFBlob(matrix_btf())
+    blob.parse()
+    pinfo = blob.elements[3].generate_pinfo()
+    assert_equal([item[0] for item in pinfo], ["a", "m", "b"])
+    matrix = pinfo[1][1]
+    assert_equal(len(matrix), 2)
+    assert_(isinstance(matrix[0], PackedArray))
+    assert_equal(matrix[0].count, 3)
+
+def test_nested_struct():
+    '''Typedefs, qualifiers, char arrays and nested structs parse'''
+
+    blob = BTFBlob(nested_btf())
+    blob.parse()
+    pinfo = blob.elements[6].generate_pinfo()
+    assert_equal([item[0] for item in pinfo], ["id", "inner"])
+    assert_equal([item[0] for item in pinfo[1][1]], ["id", "flags", "comm"])
+    assert_(isinstance(pinfo[1][1][2][1], CString))
+    assert_equal(BPFRecord(pinfo).compiled.size, blob.elements[6].size)
+
+def test_btf_type_ids():
+    '''Parsers from BTF use the map's key and value types'''
+
+    with tempfile.NamedTemporaryFile() as btf:
+        btf.write(nested_btf())
+        btf.flush()
+        m = UserspaceMap(BPF_MAP_TYPE_HASH, "test_btf", 24, 28, 4)
+        # kernel type ids 6 and 7 - struct inner and struct outer
+        m.btf_params = {"btf_key_type_id": 5, "btf_value_type_id": 6}
+        m.generate_parsers_from_btf(btf.name, records=True)
+    assert_equal(m.parsers[0].record_class.__name__, "inner")
+    assert_equal(m.parsers[1].record_class.__name__, "outer")
+    assert_equal(m.parsers[1].compiled.size, 28)
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+
+'''Parser module generation test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+import types
+import warnings
+
+from nose.tools import ok_ as assert_
+from nose.tools import raises
+from nose.tools import assert_equal
+
+from pybpfmap.btfparse import BTFBlob
+from pybpfmap.codegen import generate_module, VMLINUX
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH
+from pybpfmap.userspace import UserspaceMap
+
+BLOB = None
+
+def load(maps=None, btf_sha256=None):
+    '''Generate a module for a few vmlinux types and import it'''
+    global BLOB
+    if BLOB is None:
+        with open(VMLINUX, "rb") as btf:
+            BLOB = BTFBlob(btf.read())
+        BLOB.parse()
+    module = types.ModuleType("generated")
+    exec(generate_module(BLOB, ["sockaddr_in", "u32"], maps, btf_sha256=btf_sha256), module.__dict__)
+    return module
+
+def test_generate():
+    '''Formats, layouts and parsers are generated'''
+
+    module = load({"conns": ("sockaddr_in6", "u32")})
+    assert_equal(module.TYPES["sockaddr_in"]["format"], "=HHI8s")
+    assert_equal(module.TYPES["sockaddr_in"]["offsets"]["sin_port"], 2)
+    assert_equal(module.TYPES["u32"]["size"], 4)
+    assert_("sockaddr_in6" in module.TYPES)
+    result = module.parser("sockaddr_in").unpack(bytes([2, 0, 0, 80]) + bytes(12))
+    assert_equal(result["sin_family"], 2)
+    assert_(module.parser("sockaddr_in") is module.parser("sockaddr_in"))
+
+def test_check():
+    '''The BTF hash is checked against the running kernel'''
+
+    assert_(load().check())
+    module = load(btf_sha256="0" * 64)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        assert_(not module.check())
+    assert_equal(len(caught), 1)
+
+def test_attach_check():
+    '''attach() and parser() check the BTF once on first use'''
+
+    module = load({"conns": ("sockaddr_in", "u32")}, btf_sha256="0" * 64)
+    m = UserspaceMap(BPF_MAP_TYPE_HASH, "conns", 16, 4, 16)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        module.attach(m, "conns")
+        module.attach(m, "conns")
+        module.parser("u32")
+    assert_equal(len(caught), 1)
+    assert_equal(module.CHECKED, False)
+    assert_equal(m.parsers[0].unpack(bytes([2, 0, 0, 80]) + bytes(12))["sin_family"], 2)
+
+    module = load({"conns": ("sockaddr_in", "u32")}, btf_sha256="0" * 64)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        module.attach(m, "conns", check_btf=False)
+    assert_equal(len(caught), 0)
+    assert_equal(module.CHECKED, None)
+
+@raises(ValueError)
+def test_strict():
+    '''Strict checks raise on a mismatch'''
+    load(btf_sha256="0" * 64).check(strict=True)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+
+'''Columnar decoding test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from array import array
+
+from nose.tools import ok_ as assert_
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+
+from pybpfmap.bpfrecord import BPFRecord
+from pybpfmap.fields import CString, PackedArray
+from pybpfmap.columns import ColumnDecoder, leaves, numpy
+
+TEMPLATE = [
+    ("uid", "I"),
+    ("addr", [("ip", "I"), ("port", "H")]),
+    ("comm", CString(4)),
+    ("counters", PackedArray("Q", 2)),
+    ("flags", ["B", "B"])
+]
+
+def records(count):
+    '''A parser and count packed records'''
+    p = BPFRecord(TEMPLATE)
+    return (p, b"".join([p.pack({"uid": idx, "addr": {"ip": idx * 2, "port": 80},
+        "comm": "a", "counters": [idx, idx + 1], "flags": [1, 0]}) for idx in range(0, count)]))
+
+def test_leaves():
+    '''Columns are named by leaf path'''
+
+    names = [path for (path, leaf) in leaves(TEMPLATE, "value")]
+    assert_equal(names, ["value.uid", "value.addr.ip", "value.addr.port", "value.comm",
+                         "value.counters", "value.flags[0]", "value.flags[1]"])
+    assert_equal(leaves([("pair", "2H")], "key"), [("key.pair[0]", "H"), ("key.pair[1]", "H")])
+
+def test_decode():
+    '''Chunks are decoded into typed arrays'''
+
+    (p, raw) = records(10)
+    decoder = ColumnDecoder(p, "value")
+    columns = decoder.decode(raw[:5 * p.compiled.size])
+    decoder.decode(raw[5 * p.compiled.size:], columns)
+    assert_(isinstance(columns["value.uid"], array))
+    assert_equal(list(columns["value.uid"]), list(range(0, 10)))
+    assert_equal(columns["value.addr.ip"][3], 6)
+    assert_equal(list(columns["value.counters"][:4]), [0, 1, 1, 2])
+    assert_equal(columns["value.comm"][:8], b"a\0\0\0a\0\0\0")
+
+def test_raw():
+    '''Without a parser there is a single raw column'''
+
+    columns = ColumnDecoder(None, "key", 4).decode(bytes(range(8)))
+    assert_equal(columns, {"key": bytearray(range(8))})
+
+def test_numpy():
+    '''numpy structured arrays share the layout'''
+
+    if numpy is None:
+        raise SkipTest
+    (p, raw) = records(10)
+    columns = ColumnDecoder(p, "value").to_numpy(raw)
+    assert_equal(columns["value.uid"].tolist(), list(range(0, 10)))
+    assert_equal(columns["value.counters"].shape, (10, 2))
+    assert_equal(columns["value.comm"][0], b"a")
+    assert_(columns["value.addr.port"].flags["C_CONTIGUOUS"])
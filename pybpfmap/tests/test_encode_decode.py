@@ -21,6 +21,7 @@ from nose.tools import assert_equal
 from nose.tools import assert_is_none
 
 from pybpfmap.bpfrecord import BPFRecord
+from pybpfmap.fields import CString, PackedArray
 
 def test_create():
     '''Create a record parser'''
@@ -43,3 +44,42 @@ def test_pack():
     result = p.pack({"field1":17, "field2":46})
     assert_equal(result[0], 17)
     assert_equal(result[1], 46)
+
+def test_unpack_batch():
+    '''Unpack a buffer of back to back records'''
+
+    p = BPFRecord([("field1", "B"), ("field2", "B")])
+    result = p.unpack_batch(bytes([1, 2, 3, 4, 5, 6]))
+    assert_equal(len(result), 3)
+    assert_equal(result[2]["field1"], 5)
+    result = p.unpack_batch(bytes([1, 2, 0, 0, 5, 6, 0, 0]), 4)
+    assert_equal(len(result), 2)
+    assert_equal(result[1]["field2"], 6)
+
+def test_fields():
+    '''Pack and unpack CString and PackedArray fields'''
+
+    p = BPFRecord([("pid", "I"), ("comm", CString(8)), ("args", PackedArray("H", 2))])
+    assert_equal(p.template, "=I8s4s")
+    result = p.unpack(bytes([1, 0, 0, 0]) + b"sh\0\0\0\0\0\0" + bytes([3, 0, 4, 0]))
+    assert_equal(result["comm"], b"sh")
+    assert_equal(result["args"].tolist(), [3, 4])
+    assert_equal(p.unpack(p.pack(result)), result)
+
+def test_nested():
+    '''Pack and unpack nested structs'''
+
+    p = BPFRecord([("a", "B"), ("b", [("c", "B"), ("d", "B")]), ("e", "B")])
+    result = p.unpack(bytes([1, 2, 3, 4]))
+    assert_equal(result, {"a":1, "b":{"c":2, "d":3}, "e":4})
+    assert_equal(p.pack(result), bytes([1, 2, 3, 4]))
+
+def test_records():
+    '''Unpack into generated record classes'''
+
+    p = BPFRecord([("a", "B"), ("b", [("c", "B"), ("d", "B")])], records=True, name="Rec")
+    result = p.unpack(bytes([1, 2, 3]))
+    assert_equal(type(result).__name__, "Rec")
+    assert_equal(result.b.d, 3)
+    assert_equal(p.pack(result), bytes([1, 2, 3]))
+    assert_equal(p.unpack_batch(bytes([1, 2, 3, 4, 5, 6]))[1].a, 4)
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+
+'''Template field types test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from array import array
+
+from nose.tools import ok_ as assert_
+from nose.tools import raises
+from nose.tools import assert_equal
+
+from pybpfmap.fields import CString, PackedArray
+
+def test_cstring():
+    '''Strings stop at the first NUL'''
+
+    field = CString(8)
+    assert_equal(field.format(), "8s")
+    assert_equal(field.decode(b"bash\0\0\0\0"), b"bash")
+    assert_equal(field.decode(b"12345678"), b"12345678")
+    assert_equal(CString(8, "ascii").decode(b"bash\0abc"), "bash")
+    assert_equal(field.encode("bash"), b"bash")
+
+def test_packed_array():
+    '''Numeric arrays decode to array.array'''
+
+    field = PackedArray("I", 4)
+    assert_equal(field.format(), "16s")
+    raw = field.encode([1, 2, 3, 4])
+    assert_equal(len(raw), 16)
+    result = field.decode(raw)
+    assert_(isinstance(result, array))
+    assert_equal(result.tolist(), [1, 2, 3, 4])
+    assert_equal(field.decode(field.encode(result, "!"), "!").tolist(), [1, 2, 3, 4])
+    assert_equal(field.encode([1, 0, 0, 0], "!")[:4], bytes([0, 0, 0, 1]))
+
+def test_packed_view():
+    '''Views share the record data'''
+
+    field = PackedArray("H", 2, view=True)
+    result = field.decode(bytes([1, 0, 2, 0]), "<")
+    assert_(isinstance(result, memoryview))
+    assert_equal(result.tolist(), [1, 2])
+    assert_equal(field.encode(result, "<"), bytes([1, 0, 2, 0]))
+
+def test_repr():
+    '''Fields round trip through repr'''
+
+    for field in [CString(16), CString(16, "utf-8"), PackedArray("q", 3), PackedArray("B", 6, view=True)]:
+        assert_equal(eval(repr(field)), field)
+
+@raises(TypeError)
+def test_bad_code():
+    '''Only numeric codes are accepted'''
+    PackedArray("s", 4)
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+
+'''LPM trie key encoding test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+
+from pybpfmap.lpm import encode_prefix, decode_prefix, read_prefixes, LPMTable
+
+from nose.tools import ok_ as assert_
+from nose.tools import raises
+from nose.tools import assert_equal
+from nose.tools import assert_is_none
+
+import ipaddress
+import io
+import sys
+
+def test_encode():
+    '''Encode prefixes in the kernel key layout'''
+
+    key = encode_prefix("10.1.2.3/8")
+    assert_equal(key, (8).to_bytes(4, sys.byteorder) + bytes([10, 0, 0, 0]))
+    assert_equal(encode_prefix(ipaddress.ip_network("10.0.0.0/8")), key)
+    assert_equal(encode_prefix(("10.0.0.0", 8)), key)
+    assert_equal(len(encode_prefix("2001:db8::/32")), 20)
+    assert_equal(len(encode_prefix("10.0.0.0/8", 12)), 12)
+
+@raises(ValueError)
+def test_encode_bad_len():
+    '''Reject prefix lengths longer than the address'''
+
+    encode_prefix("10.0.0.0/33")
+
+def test_decode():
+    '''Decode keys back into networks'''
+
+    assert_equal(decode_prefix(encode_prefix("192.168.0.0/16")), ipaddress.ip_network("192.168.0.0/16"))
+    assert_equal(decode_prefix(encode_prefix("2001:db8::/32")), ipaddress.ip_network("2001:db8::/32"))
+    assert_equal(decode_prefix(encode_prefix("10.0.0.0/8", 12), 4), ipaddress.ip_network("10.0.0.0/8"))
+
+def test_read():
+    '''Read prefixes from a file'''
+
+    source = io.StringIO("# routes\n10.0.0.0/8 upstream\n\n192.168.0.0/16\n")
+    assert_equal(list(read_prefixes(source)), [("10.0.0.0/8", "upstream"), ("192.168.0.0/16", None)])
+
+def test_lookup():
+    '''Longest prefix match'''
+
+    t = LPMTable([("10.0.0.0/8", 1), ("10.1.0.0/16", 2), (encode_prefix("0.0.0.0/0"), 0), ("2001:db8::/32", 6)])
+    assert_equal(t.lookup("10.1.2.3"), (ipaddress.ip_network("10.1.0.0/16"), 2))
+    assert_equal(t.lookup("10.2.2.3")[1], 1)
+    assert_equal(t.lookup("11.2.2.3")[1], 0)
+    assert_equal(t.lookup("2001:db8::1")[1], 6)
+    assert_is_none(t.lookup("2001:db9::1"))
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+
+'''Generated record classes test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from nose.tools import ok_ as assert_
+from nose.tools import raises
+from nose.tools import assert_equal
+
+from pybpfmap.records import record_class, record_decoder
+from pybpfmap.fields import CString
+
+TEMPLATE = [
+    ("pid", "I"),
+    ("addr", [("ip", "I"), ("port", "H")]),
+    ("comm", CString(8)),
+    ("pairs", [[("a", "B")], [("a", "B")]])
+]
+
+def test_class():
+    '''Classes have slots and nested classes'''
+
+    cls = record_class(TEMPLATE, "Event")
+    assert_equal(cls.__name__, "Event")
+    assert_equal(cls._fields, ("pid", "addr", "comm", "pairs"))
+    assert_equal(cls._nested["addr"].__name__, "Event_addr")
+    assert_equal(cls._nested["pairs"]._fields, ("a",))
+    record = cls(1, None, b"", [])
+    assert_(not hasattr(record, "__dict__"))
+
+def test_decode():
+    '''Records are built out of unpacked struct items'''
+
+    cls = record_class(TEMPLATE, "Event")
+    record = record_decoder(cls)((1, 2, 3, b"sh\0\0\0\0\0\0", 4, 5))
+    assert_equal(record.pid, 1)
+    assert_equal(record.addr.port, 3)
+    assert_equal(record.comm, b"sh")
+    assert_equal(record.pairs[1].a, 5)
+    assert_equal(list(record)[0], 1)
+    assert_equal(record._asdict(),
+        {"pid":1, "addr":{"ip":2, "port":3}, "comm":b"sh", "pairs":[{"a":4}, {"a":5}]})
+
+def test_names():
+    '''Field names which are not usable as attributes are renamed'''
+
+    cls = record_class([("", "I"), ("class", "I"), ("__pad", "I"), ("", "I")])
+    assert_equal(cls._fields, ("_0", "class_", "_pad", "_3"))
+
+@raises(TypeError)
+def test_not_struct():
+    '''Only struct templates produce classes'''
+    record_class(["I", "I"])
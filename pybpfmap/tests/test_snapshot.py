@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+
+'''BPF Map snapshot test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+
+from pybpfmap.snapshot import BPFMapSnapshot, ADDED, REMOVED, CHANGED
+
+from nose.tools import ok_ as assert_
+from nose.tools import assert_equal
+from nose.tools import assert_is_none
+
+def entries(count, salt=0):
+    '''Generate count 8 byte key, 16 byte value pairs'''
+    return [(i.to_bytes(8, "little"), (i + salt).to_bytes(16, "little")) for i in range(0, count)]
+
+def test_add():
+    '''Fill a snapshot past several index resizes'''
+
+    s = BPFMapSnapshot(8, 16)
+    s.update(entries(1000))
+    assert_equal(len(s), 1000)
+    assert_(bytes(8) in s)
+    assert_((1000).to_bytes(8, "little") not in s)
+    assert_equal(len(s.keys), 8000)
+
+def test_stored_values():
+    '''Store raw values'''
+
+    s = BPFMapSnapshot(8, 16, store_values=True)
+    s.update(entries(100))
+    s.add((5).to_bytes(8, "little"), bytes(16))
+    assert_equal(len(s), 100)
+    assert_equal(s.get((5).to_bytes(8, "little")), bytes(16))
+    assert_equal(s.get((6).to_bytes(8, "little")), (6).to_bytes(16, "little"))
+    assert_is_none(s.get((100).to_bytes(8, "little")))
+
+def test_diff():
+    '''Diff and advance'''
+
+    s = BPFMapSnapshot(8, 16, store_values=True)
+    s.update(entries(100))
+
+    current = entries(110)[5:]
+    current[10] = (current[10][0], bytes(16))
+
+    changes = list(s.diff(current))
+    added = [c for c in changes if c[0] == ADDED]
+    removed = [c for c in changes if c[0] == REMOVED]
+    changed = [c for c in changes if c[0] == CHANGED]
+
+    assert_equal(len(added), 10)
+    assert_equal(len(removed), 5)
+    assert_equal(len(changed), 1)
+    assert_equal(changed[0][1], (15).to_bytes(8, "little"))
+    assert_equal(changed[0][2], (15).to_bytes(16, "little"))
+    assert_equal(changed[0][3], bytes(16))
+    assert_equal(removed[0][1], bytes(8))
+
+    # snapshot has moved to the new state
+    assert_equal(len(s), 105)
+    assert_equal(list(s.diff(current)), [])
+
+def test_diff_hashes():
+    '''Diff with value hashes only'''
+
+    s = BPFMapSnapshot(8, 16)
+    s.update(entries(100))
+    changes = list(s.diff(entries(100, salt=1)[:50], update=False))
+    assert_equal(len([c for c in changes if c[0] == CHANGED]), 50)
+    assert_equal(len([c for c in changes if c[0] == REMOVED]), 50)
+    assert_is_none(changes[0][2])
+    assert_equal(len(s), 100)
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+
+'''Unprivileged map and ring buffer backends test
+'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from nose.tools import ok_ as assert_
+from nose.tools import raises
+from nose.tools import assert_equal
+from nose.tools import assert_is_none
+
+from pybpfmap.bpfrecord import RingBufferInfo, BPFRecord, BPF_NOEXIST, BPF_EXIST
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_ARRAY, BPF_MAP_TYPE_USER_RINGBUF
+from pybpfmap.userspace import UserspaceMap
+
+from errno import EINVAL
+
+def test_hash():
+    '''Element operations follow the kernel semantics'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_HASH, "test_hash", 16, 8, 4)
+    m.generate_parsers([("uid", "Q"), ("gid", "Q")], [("count", "Q")])
+    for uid in range(0, 4):
+        assert_(m.update_elem({"uid": uid, "gid": 1}, {"count": uid}))
+    assert_(not m.update_elem({"uid": 5, "gid": 1}, {"count": 5}))
+    assert_(not m.update_elem({"uid": 1, "gid": 1}, {"count": 5}, BPF_NOEXIST))
+    assert_(m.update_elem({"uid": 1, "gid": 1}, {"count": 5}, BPF_EXIST))
+    assert_equal(m.lookup_elem({"uid": 1, "gid": 1}, want_parsed=True)["count"], 5)
+    assert_(m.delete({"uid": 0, "gid": 1}))
+    assert_is_none(m.lookup_elem({"uid": 0, "gid": 1}))
+    assert_equal(len(m), 3)
+
+def test_dump():
+    '''Dumps, syncs and columns work on top of the userspace map'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_HASH, "test_dump", 16, 8, 256)
+    m.generate_parsers([("uid", "Q"), ("gid", "Q")], [("count", "Q")])
+    result = m.sync([({"uid": uid, "gid": 1}, {"count": uid}) for uid in range(0, 100)])
+    assert_equal(result["added"], 100)
+    assert_equal(sum([len(chunk) for chunk in m.dump(chunk_size=16)]), 100)
+    assert_equal(sum(m.dump_columns()["value.count"]), sum(range(0, 100)))
+    key = m.get_next_key(None)
+    count = 0
+    while key is not None:
+        count += 1
+        key = m.get_next_key(key)
+    assert_equal(count, 100)
+
+def test_array():
+    '''Arrays are preallocated'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_ARRAY, "test_array", 4, 8, 4)
+    assert_equal(m.lookup_elem(bytes(4)), bytes(8))
+    assert_(not m.update_elem((4).to_bytes(4, "little"), bytes(8)))
+    assert_(not m.delete(bytes(4)))
+
+def test_batch():
+    '''Batches follow the kernel flag semantics and fall back per element'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_HASH, "test_batch", 4, 4, 8)
+    items = [((idx).to_bytes(4, "little"), bytes(4)) for idx in range(0, 4)]
+    assert_equal(m.backend.update_batch(bytes(4), bytes(4), BPF_NOEXIST), (None, EINVAL))
+    assert_equal(m.update_batch(items[:2]), 2)
+    assert_equal(m.update_batch(items, BPF_NOEXIST), 2)
+    assert_equal(m.update_batch(items + [((9).to_bytes(4, "little"), bytes(4))], BPF_EXIST), 4)
+    assert_equal(m.delete_batch([key for (key, value) in items[1:]] + [bytes(4)]), 4)
+    assert_equal(len(m), 0)
+
+@raises(OSError)
+def test_array_delete_batch():
+    '''Arrays have no batch delete and the per element one fails'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_ARRAY, "test_array", 4, 8, 4)
+    m.delete_batch([bytes(4)])
+
+def test_publish():
+    '''Publish and freeze'''
+
+    m = UserspaceMap(BPF_MAP_TYPE_HASH, "test_publish", 4, 4, 8)
+    m.publish([(bytes(4), b"abcd")])
+    assert_(not m.update_elem(bytes(4), bytes(4)))
+    assert_(m.freeze())
+    assert_(m.is_frozen())
+    assert_(m.publish() is None)
+    assert_equal(m.lookup_elem(bytes(4)), b"abcd")
+
+def test_ringbuf():
+    '''Anonymous rings wrap around like kernel ones'''
+
+    ring = RingBufferInfo(-1, 4096, 0, BPF_MAP_TYPE_USER_RINGBUF, anonymous=True)
+    received = 0
+    for idx in range(0, 1000):
+        sample = bytes([idx % 256]) * (idx % 37 + 1)
+        if not ring.submit(sample):
+            received += len(ring.fetch_next_records())
+            assert_(ring.submit(sample))
+    records = ring.fetch_next_records()
+    assert_equal(records[-1], sample)
+    assert_equal(received + len(records), 1000)
+
+    parser = BPFRecord([("a", "I"), ("b", "I")])
+    assert_(ring.submit(parser.pack({"a": 1, "b": 2})))
+    assert_equal(ring.fetch_next_parsed(parser), [{"a": 1, "b": 2}])
+    ring.cleanup()
+
+@raises(ValueError)
+def test_ringbuf_size():
+    '''Anonymous rings must be a power of 2 pages'''
+    RingBufferInfo(-1, 3 * 4096, 0, BPF_MAP_TYPE_USER_RINGBUF, anonymous=True)
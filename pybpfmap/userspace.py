@@ -0,0 +1,173 @@
+'''In memory stand in for BPF maps'''
+
+# pybpfmap, Copyright (c) 2023 RedHat Inc
+# pybpfmap, Copyright (c) 2023 Cambridge Greys Ltd
+
+# This source code is licensed under both the BSD-style license (found in the
+# LICENSE file in the root directory of this source tree) and the GPLv2 (found
+# in the COPYING file in the root directory of this source tree).
+# You may select, at your option, one of the above-listed licenses.
+
+from errno import ENOENT, EEXIST, E2BIG, EINVAL, EPERM
+from itertools import islice
+import os
+import sys
+
+from pybpfmap.bpfrecord import BPFMap, BPF_NOEXIST, BPF_EXIST, BPF_F_LOCK, ENOTSUPP
+from pybpfmap.map_types import BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_ARRAY
+from pybpfmap.map_types import BPF_MAP_TYPE_LRU_HASH, BPF_MAP_TYPE_PERCPU_HASH
+
+HASH_TYPES = [BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_LRU_HASH, BPF_MAP_TYPE_PERCPU_HASH]
+
+def fail(err):
+    '''Fail a call with err the way the kernel would'''
+    raise OSError(err, os.strerror(err))
+
+class UserspaceBackend():
+    '''The syscall level of a hash or array map, kept in a dict.
+
+    Methods mirror the bpf_map_* calls. Keys and values are bytes(),
+    failures raise OSError with the errno the kernel returns: update
+    flags are checked, hash maps refuse new keys once max_entries is
+    reached, array maps are preallocated and cannot be deleted from,
+    batch updates accept no flags other than BPF_F_LOCK (and there are
+    no spin locks here) and arrays have no batch delete. Batch calls
+    return (count, errno) as the kernel writes back a partial count on
+    errors; count is None if it is not written back.
+    '''
+    def __init__(self, map_type, key_size, value_size, max_entries):
+        if map_type not in HASH_TYPES and map_type != BPF_MAP_TYPE_ARRAY:
+            raise ValueError
+        if map_type == BPF_MAP_TYPE_ARRAY and key_size != 4:
+            raise ValueError
+
+        self.map_type = map_type
+        self.keysize = key_size
+        self.valuesize = value_size
+        self.max_entries = max_entries
+        self.frozen = False
+        self.elements = {}
+        if map_type == BPF_MAP_TYPE_ARRAY:
+            zero = bytes(value_size)
+            for index in range(0, max_entries):
+                self.elements[index.to_bytes(4, sys.byteorder)] = zero
+
+    def lookup_elem(self, key):
+        '''Value for key'''
+        try:
+            return self.elements[key]
+        except KeyError:
+            fail(ENOENT)
+
+    def lookup_and_delete_elem(self, key):
+        '''Value for key, the key is deleted'''
+        if self.map_type == BPF_MAP_TYPE_ARRAY:
+            fail(ENOTSUPP)
+        value = self.lookup_elem(key)
+        self.delete_elem(key)
+        return value
+
+    def update_elem(self, key, value, flags):
+        '''Insert or update key'''
+        if self.frozen:
+            fail(EPERM)
+        if flags & BPF_F_LOCK or flags > BPF_EXIST:
+            fail(EINVAL)
+        exists = key in self.elements
+        if self.map_type == BPF_MAP_TYPE_ARRAY and not exists:
+            fail(E2BIG)
+        if flags == BPF_NOEXIST and exists:
+            fail(EEXIST)
+        if flags == BPF_EXIST and not exists:
+            fail(ENOENT)
+        if not exists and len(self.elements) >= self.max_entries:
+            fail(E2BIG)
+        self.elements[key] = value
+
+    def delete_elem(self, key):
+        '''Delete key'''
+        if self.frozen:
+            fail(EPERM)
+        if self.map_type == BPF_MAP_TYPE_ARRAY:
+            fail(EINVAL)
+        try:
+            del self.elements[key]
+        except KeyError:
+            fail(ENOENT)
+
+    def get_next_key(self, key):
+        '''Key following key in iteration order. A missing key (or None)
+        gives the first key.'''
+        keys = iter(self.elements)
+        if key in self.elements:
+            for item in keys:
+                if item == key:
+                    break
+        try:
+            return next(keys)
+        except StopIteration:
+            fail(ENOENT)
+
+    def freeze(self):
+        '''No further updates or deletes'''
+        # map_freeze() checks for write permission before anything else
+        # and a frozen map has lost it, so freezing twice fails with EPERM
+        if self.frozen:
+            fail(EPERM)
+        self.frozen = True
+
+    def lookup_batch(self, position, count):
+        '''Up to count elements from position on. Returns (keys, values,
+        next position, errno), errno is ENOENT once the map is done'''
+        items = list(islice(self.elements.items(), position, position + count))
+        position += len(items)
+        err = 0
+        if position >= len(self.elements):
+            err = ENOENT
+        return (b"".join([key for (key, value) in items]),
+                b"".join([value for (key, value) in items]), position, err)
+
+    def update_batch(self, keys, values, flags):
+        '''Update back to back keys and values, returns (count, errno)'''
+        # BPF_F_LOCK is the only batch flag and there are no spin locks
+        if flags:
+            return (None, EINVAL)
+        done = 0
+        for offset in range(0, len(keys) // self.keysize):
+            try:
+                self.update_elem(keys[offset * self.keysize:(offset + 1) * self.keysize],
+                                 values[offset * self.valuesize:(offset + 1) * self.valuesize], flags)
+            except OSError as error:
+                return (done, error.errno)
+            done += 1
+        return (done, 0)
+
+    def delete_batch(self, keys):
+        '''Delete back to back keys, returns (count, errno)'''
+        if self.map_type == BPF_MAP_TYPE_ARRAY:
+            return (None, ENOTSUPP)
+        done = 0
+        for offset in range(0, len(keys) // self.keysize):
+            try:
+                self.delete_elem(keys[offset * self.keysize:(offset + 1) * self.keysize])
+            except OSError as error:
+                return (done, error.errno)
+            done += 1
+        return (done, 0)
+
+class UserspaceMap(BPFMap):
+    '''A BPFMap over a UserspaceBackend instead of a kernel map.
+
+    All BPFMap code - parsers, batches and their fallbacks, dumps,
+    snapshots, diffs, sync, publish and columnar dumps - runs as it
+    does on a real map, only the bpf_map_* calls at the bottom are
+    served from a dict. It needs no privileges and is meant for tests
+    and benchmarks.
+    '''
+    def __init__(self, map_type, name, key_size, value_size, max_entries):
+        self.backend = UserspaceBackend(map_type, key_size, value_size, max_entries)
+        super().__init__(-1, map_type, name, key_size, value_size, max_entries,
+                         backend=self.backend)
+
+    def __len__(self):
+        return len(self.backend.elements)